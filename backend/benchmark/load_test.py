@@ -0,0 +1,444 @@
+"""
+API 压力测试，向本地 Postgres 写入指定数量的测试用户和 ticket，
+按固定并发调用登录、列表、创建、审批和上传接口，记录吞吐量、p50 / p95 / p99 延迟和服务进程 RSS，
+以及服务端 /metrics 统计的每个请求占用的数据库连接次数，结果写入 JSON 报告，可与其他提交的报告对比
+
+Run under the backend folder with the database of src/config.json, against a running server:
+
+    uvicorn src.main:app --workers 1 &
+    python -m benchmark.load_test --users 1000 --tickets 100000 --server-pid $!
+
+or with the app in this process (client and server share one event loop, only compare runs of the same mode):
+
+    python -m benchmark.load_test --in-process --requests 500 --concurrency 16
+
+compare with the report of another commit, exits with 1 when a scenario regressed more than --max-regression:
+
+    python -m benchmark.load_test --skip-seed --compare load_test_1a2b3c4.json
+
+Checkouts per request are read from /metrics before and after each scenario, with several workers the two
+scrapes may hit different processes, run the server with one worker to measure them.
+
+Test data is tagged by the loadtest- email prefix and replaced on every seed, nothing else is touched,
+except the ticket summary table which is rebuilt afterwards.
+Files of the upload scenario stay in the attachment storage.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import httpx
+from sqlalchemy import select, delete, insert
+
+from src.db.db_configs import async_engine
+from src.db.db_enum import TicketStatus, UserGroup
+from src.db.db_generator import init_db
+from src.db.modals.ticket import Ticket
+from src.db.modals.ticket_summary import TicketSummary
+from src.db.modals.user import User
+from src.service.report_service import _rank
+from src.service.summary_service import rebuild_ticket_summary
+from src.utils.password import hash_password
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, RSS is read from /proc on linux without it
+    psutil = None
+
+EMAIL_PREFIX = "loadtest-"
+EMAIL_DOMAIN = "@example.com"
+EMPLOYER_EMAIL = f"{EMAIL_PREFIX}employer{EMAIL_DOMAIN}"
+PASSWORD = "loadtest-password"
+SEED_CHUNK_SIZE = 5000
+SCENARIOS = ("login", "list_tickets", "create_ticket", "approve", "upload")
+# route label of each scenario in the request metrics
+SCENARIO_ROUTES = {
+    "login": ("POST", "/api/login"),
+    "list_tickets": ("GET", "/api/tickets/"),
+    "create_ticket": ("POST", "/api/tickets/"),
+    "approve": ("PUT", "/api/tickets/{ticket_id}/status"),
+    "upload": ("POST", "/api/files/tickets/attachment"),
+}
+CHECKOUTS_SAMPLE = re.compile(r'^http_request_db_checkouts_(sum|count)\{method="([^"]*)",route="([^"]*)"\} (\S+)$')
+
+
+def employee_email(index: int) -> str:
+    return f"{EMAIL_PREFIX}{index}{EMAIL_DOMAIN}"
+
+
+async def seed(users: int, tickets: int, pending_ratio: float, rng: random.Random):
+    """replace the loadtest users and their tickets, all users share one password hash"""
+    password = await hash_password(PASSWORD)
+    now = datetime.now()
+    loadtest_users = select(User.id).where(User.email.like(f"{EMAIL_PREFIX}%{EMAIL_DOMAIN}"))
+
+    async with async_engine.begin() as connection:
+        await connection.execute(delete(Ticket).where(Ticket.purchaser_id.in_(loadtest_users)))
+        # ticket_summary rows reference the users too, delete them before the users
+        await connection.execute(delete(TicketSummary).where(TicketSummary.purchaser_id.in_(loadtest_users)))
+        await connection.execute(delete(User).where(User.id.in_(loadtest_users)))
+
+        accounts = [{"username": "Load Test Employer", "email": EMPLOYER_EMAIL, "group": UserGroup.EMPLOYER}]
+        accounts += [{"username": f"Load Test {i}", "email": employee_email(i), "group": UserGroup.EMPLOYEE}
+                     for i in range(users)]
+        result = await connection.execute(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            [{**account, "password": password, "created_time": now, "updated_time": now, "deleted": 0}
+             for account in accounts]
+        )
+        employee_ids = result.scalars().all()[1:]
+
+        other_statuses = [TicketStatus.APPROVED, TicketStatus.REJECTED]
+        for start in range(0, tickets, SEED_CHUNK_SIZE):
+            rows = []
+            for _ in range(start, min(start + SEED_CHUNK_SIZE, tickets)):
+                created_time = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+                rows.append({
+                    "purchaser_id": rng.choice(employee_ids),
+                    "amount": Decimal(rng.randint(100, 500000)).scaleb(-2),
+                    "currency": "CNY",
+                    "merchant": f"商户 {rng.randint(1, 500)}",
+                    "description": f"load test ticket {rng.randint(1, 10000)}",
+                    "attachment_link": "",
+                    "status": TicketStatus.PENDING if rng.random() < pending_ratio else rng.choice(other_statuses),
+                    "purchase_time": created_time - timedelta(days=rng.randint(0, 30)),
+                    "created_time": created_time,
+                    "updated_time": created_time,
+                    "deleted": 0,
+                })
+            await connection.execute(insert(Ticket), rows)
+
+    await rebuild_ticket_summary()
+
+
+async def pending_ticket_ids(count: int) -> list[int]:
+    async with async_engine.connect() as connection:
+        result = await connection.execute(
+            select(Ticket.id).join(User, Ticket.purchaser_id == User.id).where(
+                User.email.like(f"{EMAIL_PREFIX}%{EMAIL_DOMAIN}"), Ticket.status == TicketStatus.PENDING,
+                Ticket.deleted == 0,
+            ).order_by(Ticket.id).limit(count)
+        )
+        return result.scalars().all()
+
+
+def read_rss(pid: int | None) -> int | None:
+    """resident set size in bytes"""
+    if pid is None:
+        return None
+    if psutil is not None:
+        return psutil.Process(pid).memory_info().rss
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+async def _sample_rss(pid: int | None, samples: list[int], stop: asyncio.Event, interval: float = 0.1):
+    while not stop.is_set():
+        rss = read_rss(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(interval)
+
+
+class LoadTestContext:
+
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random, users: int, upload_kb: int):
+        self.client = client
+        self.rng = rng
+        self.users = users
+        self.upload_kb = upload_kb
+        self.employee_tokens: list[str] = []
+        self.employer_token = ""
+        self.pending_ids = iter(())
+
+    def employee_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.rng.choice(self.employee_tokens)}"}
+
+    def employer_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.employer_token}"}
+
+
+async def login(context: LoadTestContext, email: str) -> str:
+    response = await context.client.post("/api/login", json={"email": email, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["data"]["token"]
+
+
+async def _login(context: LoadTestContext) -> httpx.Response:
+    email = employee_email(context.rng.randrange(context.users))
+    return await context.client.post("/api/login", json={"email": email, "password": PASSWORD})
+
+
+async def _list_tickets(context: LoadTestContext) -> httpx.Response:
+    # employers page through every ticket, employees through their own
+    headers = context.employer_headers() if context.rng.random() < 0.5 else context.employee_headers()
+    return await context.client.get("/api/tickets/", params={"limit": 20}, headers=headers)
+
+
+async def _create_ticket(context: LoadTestContext) -> httpx.Response:
+    return await context.client.post("/api/tickets/", headers=context.employee_headers(), json={
+        "amount": f"{context.rng.randint(100, 500000) / 100:.2f}", "currency": "CNY",
+        "merchant": f"商户 {context.rng.randint(1, 500)}", "description": "load test",
+    })
+
+
+async def _approve(context: LoadTestContext) -> httpx.Response:
+    ticket_id = next(context.pending_ids)
+    return await context.client.put(f"/api/tickets/{ticket_id}/status", headers=context.employer_headers(),
+                                    json={"status": TicketStatus.APPROVED.name})
+
+
+async def _upload(context: LoadTestContext) -> httpx.Response:
+    # random content, the upload is never answered by the deduplication
+    content = context.rng.randbytes(context.upload_kb * 1024)
+    return await context.client.post("/api/files/tickets/attachment", headers=context.employee_headers(),
+                                     files={"files": ("loadtest.txt", content, "text/plain")})
+
+
+SCENARIO_REQUESTS = {
+    "login": _login,
+    "list_tickets": _list_tickets,
+    "create_ticket": _create_ticket,
+    "approve": _approve,
+    "upload": _upload,
+}
+
+
+async def scrape_checkouts(client: httpx.AsyncClient) -> dict | None:
+    """(method, route) -> [sum, count] of http_request_db_checkouts, None when the server exposes no metrics"""
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+
+    values = {}
+    for line in response.text.splitlines():
+        match = CHECKOUTS_SAMPLE.match(line)
+        if match:
+            field, method, route, value = match.groups()
+            values.setdefault((method, route), [0.0, 0.0])[field == "count"] = float(value)
+    return values
+
+
+def _checkouts_per_request(before: dict | None, after: dict | None, route: tuple) -> float | None:
+    if before is None or after is None:
+        return None
+    total_before, count_before = before.get(route, (0.0, 0.0))
+    total_after, count_after = after.get(route, (0.0, 0.0))
+    if count_after <= count_before:
+        return None
+    return round((total_after - total_before) / (count_after - count_before), 2)
+
+
+def _latency_ms(latencies: list[float], percentile: float) -> float:
+    return round(sorted(latencies)[_rank(len(latencies), percentile)] * 1000, 2)
+
+
+async def run_scenario(context: LoadTestContext, name: str, requests: int, concurrency: int, warmup: int,
+                       server_pid: int | None) -> dict:
+    send = SCENARIO_REQUESTS[name]
+    for _ in range(warmup):
+        await send(context)
+    checkouts_before = await scrape_checkouts(context.client)
+
+    latencies = []
+    statuses = {}
+    counter = itertools.count()
+
+    async def worker():
+        while next(counter) < requests:
+            started = time.perf_counter()
+            try:
+                response = await send(context)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    rss_samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_rss(server_pid, rss_samples, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+    checkouts_after = await scrape_checkouts(context.client)
+
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": round(requests / elapsed, 2),
+        # connections checked out of the server's pools per request, 1 with the request scoped session
+        "db_checkouts_per_request": _checkouts_per_request(checkouts_before, checkouts_after, SCENARIO_ROUTES[name]),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 2),
+            "p50": _latency_ms(latencies, 50),
+            "p95": _latency_ms(latencies, 95),
+            "p99": _latency_ms(latencies, 99),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "rss_mb": {
+            "start": round(rss_samples[0] / 1024 / 1024, 1),
+            "peak": round(max(rss_samples) / 1024 / 1024, 1),
+            "end": round(rss_samples[-1] / 1024 / 1024, 1),
+        } if rss_samples else None,
+    }
+
+
+def git_revision() -> dict:
+    def git(*args) -> str | None:
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def compare_reports(previous: dict, current: dict, max_regression: float) -> bool:
+    """prints the change of every scenario, returns False when any of them regressed more than max_regression"""
+    passed = True
+    print(f"\ncompared with {previous['meta']['git'].get('commit')}:")
+    for name, result in current["scenarios"].items():
+        before = previous["scenarios"].get(name)
+        if before is None:
+            continue
+        throughput = result["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0
+        p95 = result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1 if before["latency_ms"]["p95"] else 0
+        regressed = throughput < -max_regression or p95 > max_regression
+        passed = passed and not regressed
+        checkouts = ""
+        if before.get("db_checkouts_per_request") is not None and result["db_checkouts_per_request"] is not None:
+            checkouts = f", checkouts {before['db_checkouts_per_request']} -> {result['db_checkouts_per_request']}"
+        print(f"{name:>14}: throughput {throughput:+.1%}, p95 {p95:+.1%}{checkouts}"
+              f"{'  REGRESSED' if regressed else ''}")
+    return passed
+
+
+async def main_async(args) -> int:
+    rng = random.Random(args.seed)
+    if not args.skip_seed:
+        init_db()
+        started = time.perf_counter()
+        await seed(args.users, args.tickets, args.pending_ratio, rng)
+        print(f"seeded {args.users} users and {args.tickets} tickets in {time.perf_counter() - started:.1f}s")
+
+    scenarios = args.scenarios.split(",")
+    if unknown := set(scenarios) - set(SCENARIOS):
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.in_process:
+        from src.main import app
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://loadtest"
+        server_pid = os.getpid()
+    else:
+        transport = None
+        base_url = args.base_url
+        server_pid = args.server_pid
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits,
+                                 timeout=args.timeout) as client:
+        context = LoadTestContext(client, rng, args.users, args.upload_kb)
+        context.employer_token = await login(context, EMPLOYER_EMAIL)
+        context.employee_tokens = await asyncio.gather(*(login(context, employee_email(i))
+                                                         for i in range(min(args.sessions, args.users))))
+        if "approve" in scenarios:
+            ids = await pending_ticket_ids(args.requests + args.warmup)
+            if len(ids) < args.requests + args.warmup:
+                raise SystemExit(f"only {len(ids)} pending tickets left for approve, seed again or lower --requests")
+            context.pending_ids = iter(ids)
+
+        results = {}
+        for name in scenarios:
+            requests = args.login_requests if name == "login" else args.requests
+            results[name] = await run_scenario(context, name, requests, args.concurrency, args.warmup, server_pid)
+            latency = results[name]["latency_ms"]
+            checkouts = results[name]["db_checkouts_per_request"]
+            print(f"{name:>14}: {results[name]['throughput_rps']:8.1f} req/s, p50 {latency['p50']:.1f} ms, "
+                  f"p95 {latency['p95']:.1f} ms, p99 {latency['p99']:.1f} ms, errors {results[name]['errors']}, "
+                  f"checkouts/request {checkouts if checkouts is not None else '-'}")
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "mode": "in-process" if args.in_process else "http",
+            "users": args.users,
+            "tickets": args.tickets,
+            "requests": args.requests,
+            "login_requests": args.login_requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "scenarios": results,
+    }
+    output = args.output or f"load_test_{report['meta']['git']['commit'] or 'unknown'}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"report written to {output}")
+
+    await async_engine.dispose()
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            if not compare_reports(json.load(f), report, args.max_regression):
+                return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--in-process", action="store_true", help="serve src.main:app in this process")
+    parser.add_argument("--server-pid", type=int, help="process whose RSS is sampled, the server worker")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tickets", type=int, default=100000)
+    parser.add_argument("--pending-ratio", type=float, default=0.5)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data of the previous seed")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="measured requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=100,
+                        help="measured logins, each one is a scrypt verification of password_hash_rounds")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=20, help="requests per scenario before measuring")
+    parser.add_argument("--sessions", type=int, default=20, help="employees logged in for the other scenarios")
+    parser.add_argument("--upload-kb", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="report path, load_test_<commit>.json by default")
+    parser.add_argument("--compare", help="report of a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed drop of throughput / rise of p95 latency, 0.2 = 20%%")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+列表查询基准测试，对比加载完整 ORM 实体和只查询列表所需的列（行元组）
+
+Run under the backend folder, uses an in-memory sqlite database by default, pass a synchronous postgres url
+(e.g. postgresql+psycopg2://...) to measure against a real server, the tables are created and dropped:
+
+    python -m benchmark.projection_benchmark --rows 50000 --users 500
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+from src.db.db_enum import TicketStatus, UserGroup
+from src.db.modals.base_db import BaseDB
+from src.db.modals.ticket import Ticket
+from src.db.modals.user import User
+from src.service.ticket_service import TICKET_LIST_COLUMNS
+from src.service.user_service import USER_LIST_COLUMNS
+
+
+@compiles(REGCONFIG, "sqlite")
+def _regconfig_on_sqlite(type_, compiler, **kw):
+    return "TEXT"
+
+
+def create_benchmark_engine(database_url: str):
+    engine = create_engine(database_url)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _register_functions(connection, _):
+            # stands in for postgres to_tsvector in the search document index
+            connection.create_function("to_tsvector", 2, lambda config, text: text.lower(), deterministic=True)
+    return engine
+
+
+def seed(session: Session, rows: int, users: int, seed_value: int = 42):
+    rng = random.Random(seed_value)
+    started = datetime(2025, 1, 1)
+    session.execute(insert(User), [{
+        "id": i + 1, "username": f"员工 {i}", "email": f"user{i}@example.com", "password": "$2b$12$" + "x" * 53,
+        "group": UserGroup.EMPLOYEE if i else UserGroup.EMPLOYER, "created_time": started, "updated_time": started,
+        "deleted": 0,
+    } for i in range(users)])
+    session.execute(insert(Ticket), [{
+        "purchaser_id": rng.randint(1, users), "amount": Decimal(rng.randint(1, 500000)).scaleb(-2),
+        "currency": "CNY", "merchant": f"商户 {rng.randint(1, 500)}", "description": "办公用品 " * 8,
+        "attachment_link": f"static/ab/cd/{i:064x}.png", "status": rng.choice(list(TicketStatus)),
+        "purchase_time": started + timedelta(minutes=i), "created_time": started + timedelta(minutes=i),
+        "updated_time": started + timedelta(minutes=i), "deleted": 0,
+    } for i in range(rows)])
+    session.commit()
+
+
+def ticket_entities(session: Session) -> list:
+    """the previous list query: one Ticket entity per row, added to the identity map"""
+    return session.execute(
+        select(Ticket, User.email, User.username).join(User, Ticket.purchaser_id == User.id).
+        where(Ticket.deleted == 0).order_by(Ticket.created_time.desc(), Ticket.id.desc())
+    ).all()
+
+
+def ticket_rows(session: Session) -> list:
+    return session.execute(
+        select(*TICKET_LIST_COLUMNS).join(User, Ticket.purchaser_id == User.id).
+        where(Ticket.deleted == 0).order_by(Ticket.created_time.desc(), Ticket.id.desc())
+    ).all()
+
+
+def user_entities(session: Session) -> list:
+    return session.execute(select(User).order_by(User.deleted, User.id.desc())).scalars().all()
+
+
+def user_rows(session: Session) -> list:
+    return session.execute(select(*USER_LIST_COLUMNS).order_by(User.deleted, User.id.desc())).all()
+
+
+def measure(name: str, function, engine, repeat: int) -> int:
+    timings = []
+    peak = 0
+    count = 0
+    for _ in range(repeat):
+        # a new session each time, like one request, the identity map starts empty
+        with Session(engine) as session:
+            tracemalloc.start()
+            started = time.perf_counter()
+            count = len(function(session))
+            timings.append(time.perf_counter() - started)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    print(f"{name:>16}: best {min(timings) * 1000:.1f} ms, peak memory {peak / 1024 / 1024:.1f} MB, {count} rows")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_benchmark_engine(args.database_url)
+    tables = [User.__table__, Ticket.__table__]
+    BaseDB.metadata.create_all(engine, tables=tables)
+    try:
+        with Session(engine) as session:
+            seed(session, args.rows, args.users)
+        print(f"database={engine.dialect.name}, rows={args.rows}, users={args.users}, repeat={args.repeat}")
+
+        assert measure("ticket entities", ticket_entities, engine, args.repeat) == \
+            measure("ticket rows", ticket_rows, engine, args.repeat)
+        assert measure("user entities", user_entities, engine, args.repeat) == \
+            measure("user rows", user_rows, engine, args.repeat)
+    finally:
+        BaseDB.metadata.drop_all(engine, tables=tables)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+金额报表基准测试，对比逐行 ORM 对象 Decimal 累加和整数数组向量化统计
+
+Run under the backend folder, no database needed, rows are generated in memory:
+
+    python -m benchmark.report_benchmark --rows 200000 --users 500
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from array import array
+from decimal import Decimal
+
+from src.db.modals.ticket import Ticket
+from src.service import report_service
+from src.service.report_service import summarize_amounts, DEFAULT_PERCENTILES, _rank
+from src.utils.money import to_minor_units, amount_to_json
+
+
+def generate_rows(rows: int, users: int, seed: int = 42) -> list[tuple[int, Decimal]]:
+    rng = random.Random(seed)
+    return [(rng.randint(1, users), Decimal(rng.randint(1, 500000)).scaleb(-2)) for _ in range(rows)]
+
+
+def orm_row_by_row(rows: list[tuple[int, Decimal]]) -> dict:
+    """what a report built on list_tickets does: one ORM object per ticket, python Decimal arithmetic"""
+    tickets = [Ticket(purchaser_id=purchaser_id, amount=amount) for purchaser_id, amount in rows]
+    total = Decimal(0)
+    per_user = {}
+    for ticket in tickets:
+        total += ticket.amount
+        per_user[ticket.purchaser_id] = per_user.get(ticket.purchaser_id, Decimal(0)) + ticket.amount
+    ordered = sorted(ticket.amount for ticket in tickets)
+    return {
+        "total_amount": amount_to_json(total),
+        "percentiles": {f"p{p:g}": amount_to_json(ordered[_rank(len(ordered), p)]) for p in DEFAULT_PERCENTILES},
+        "users": len(per_user),
+    }
+
+
+def vectorized(rows: list[tuple[int, Decimal]]) -> dict:
+    """the database returns minor units, rows are loaded into int64 arrays like report_service.load_amounts"""
+    purchaser_ids = array("q", (purchaser_id for purchaser_id, _ in rows))
+    amounts = array("q", (to_minor_units(amount) for _, amount in rows))
+    report = summarize_amounts(purchaser_ids, amounts)
+    return {"total_amount": report["total_amount"], "percentiles": report["percentiles"],
+            "users": len(report["per_user"])}
+
+
+def measure(name: str, function, rows) -> dict:
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function(rows)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>20}: {elapsed * 1000:.1f} ms, peak memory {peak / 1024 / 1024:.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows, args.users)
+    print(f"rows={args.rows}, users={args.users}, numpy={'yes' if report_service.numpy is not None else 'no'}")
+
+    expected = measure("orm row by row", orm_row_by_row, rows)
+    results = [measure("vectorized", vectorized, rows)]
+    if report_service.numpy is not None:
+        # same arrays without numpy, the fallback used when it is not installed
+        numpy, report_service.numpy = report_service.numpy, None
+        try:
+            results.append(measure("arrays, no numpy", vectorized, rows))
+        finally:
+            report_service.numpy = numpy
+
+    for result in results:
+        assert result == expected, f"results differ: {result} != {expected}"
+    print(f"total={expected['total_amount']}, percentiles={expected['percentiles']}, results match")
+
+
+if __name__ == "__main__":
+    main()
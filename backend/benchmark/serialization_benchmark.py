@@ -0,0 +1,121 @@
+"""
+ticket 列表序列化基准测试，对比原来的逐字段拼 dict + 标准库 JSONResponse 和 schemas 编码函数 + FastJSONResponse
+
+Run under the backend folder, no database needed, tickets are built in memory:
+
+    python -m benchmark.serialization_benchmark --rows 10000 --repeat 20
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+
+from src.common.schemas import encode_ticket
+from src.db.db_enum import TicketStatus
+from src.db.modals.ticket import Ticket
+from src.service.file_service import resolve_attachment_link
+from src.utils import response
+from src.utils.money import amount_to_json
+from src.utils.response import FastJSONResponse
+
+
+def generate_tickets(rows: int, attachment_ratio: float, seed: int = 42) -> list[dict]:
+    rng = random.Random(seed)
+    started = datetime(2025, 1, 1)
+    tickets = []
+    for i in range(rows):
+        attachment_link = f"static/ab/cd/{i:064x}.png" if rng.random() < attachment_ratio else ""
+        ticket = Ticket(
+            id=i + 1, amount=Decimal(rng.randint(1, 500000)).scaleb(-2), currency="CNY",
+            merchant=f"商户 {rng.randint(1, 500)}", description=None, attachment_link=attachment_link,
+            purchase_time=started + timedelta(minutes=i), created_time=started + timedelta(minutes=i, seconds=30),
+            status=rng.choice(list(TicketStatus)),
+        )
+        tickets.append({"ticket": ticket, "user_info": {"email": f"user{i % 500}@example.com",
+                                                        "username": f"员工 {i % 500}"}})
+    return tickets
+
+
+def baseline(tickets_with_user_info: list[dict]) -> bytes:
+    """the previous controller code: dict built field by field with repeated lookups, strftime, stdlib json"""
+    thumbnail_urls = {}
+    ticket_list = []
+    for ticket in tickets_with_user_info:
+        ticket_list.append({
+            "id": ticket.get("ticket").id,
+            "amount": amount_to_json(ticket.get("ticket").amount),
+            "currency": ticket.get("ticket").currency,
+            "merchant": ticket.get("ticket").merchant,
+            "description": ticket.get("ticket").description,
+            "attachmentUrl": resolve_attachment_link(ticket.get("ticket").attachment_link),
+            "thumbnailUrls": [thumbnail_urls.get(reference) for reference in
+                              (ticket.get("ticket").attachment_link or "").split(",") if reference],
+            "paymentTime": ticket.get("ticket").purchase_time.strftime("%Y-%m-%d %H:%M"),
+            "userEmail": ticket.get("user_info").get("email"),
+            "username": ticket.get("user_info").get("username"),
+            "status": ticket.get("ticket").status.name,
+            "createdAt": ticket.get("ticket").created_time.strftime("%Y-%m-%d %H:%M"),
+        })
+    return JSONResponse(content={"data": ticket_list, "next_cursor": None, "success": True}).body
+
+
+def to_rows(tickets_with_user_info: list[dict]) -> list[tuple]:
+    """the same tickets as the projected rows of ticket_service.TICKET_LIST_COLUMNS"""
+    return [(ticket["ticket"].id, ticket["ticket"].amount, ticket["ticket"].currency, ticket["ticket"].merchant,
+             ticket["ticket"].description, ticket["ticket"].attachment_link, ticket["ticket"].purchase_time,
+             ticket["ticket"].status, ticket["ticket"].created_time, ticket["user_info"]["email"],
+             ticket["user_info"]["username"]) for ticket in tickets_with_user_info]
+
+
+def optimized(rows: list[tuple]) -> bytes:
+    thumbnail_urls = {}
+    ticket_list = [encode_ticket(row, thumbnail_urls) for row in rows]
+    return FastJSONResponse(content={"data": ticket_list, "next_cursor": None, "success": True}).body
+
+
+def measure(name: str, function, tickets, repeat: int) -> tuple[float, bytes]:
+    function(tickets)  # warm up
+    timings = []
+    body = b""
+    for _ in range(repeat):
+        started = time.process_time()
+        body = function(tickets)
+        timings.append(time.process_time() - started)
+    median = statistics.median(timings)
+    print(f"{name:>28}: median cpu {median * 1000:.1f} ms per response, {len(body) / 1024:.0f} KB")
+    return median, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--attachment-ratio", type=float, default=0.0,
+                        help="share of tickets with an attachment, signing urls costs the same in both paths")
+    args = parser.parse_args()
+
+    tickets = generate_tickets(args.rows, args.attachment_ratio)
+    print(f"rows={args.rows}, repeat={args.repeat}, attachment_ratio={args.attachment_ratio}, "
+          f"orjson={'yes' if response.orjson is not None else 'no'}")
+
+    baseline_time, baseline_body = measure("dicts + JSONResponse", baseline, tickets, args.repeat)
+    rows = to_rows(tickets)
+    optimized_time, optimized_body = measure("schemas + FastJSONResponse", optimized, rows, args.repeat)
+    if response.orjson is not None:
+        orjson, response.orjson = response.orjson, None
+        try:
+            measure("schemas + json fallback", optimized, rows, args.repeat)
+        finally:
+            response.orjson = orjson
+
+    assert json.loads(optimized_body) == json.loads(baseline_body), "responses differ"
+    print(f"speedup {baseline_time / optimized_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
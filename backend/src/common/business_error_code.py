@@ -1,8 +1,8 @@
-from enum import Enum
+from enum import IntEnum
 
 
 # for frontend message customizing
-class ErrorCode(Enum):
+class ErrorCode(IntEnum):
 
     # 4xx series, client error
 
@@ -17,6 +17,9 @@ class ErrorCode(Enum):
     # 403, forbidden
     permission_denied = 40302  # not enough permission to finish the operation
 
+    # 404, not found
+    ticket_not_found = 40400
+
     # 5xx series, server error
 
     # 500, internal server error
@@ -0,0 +1,99 @@
+"""
+接口返回结构的类型定义（用于 OpenAPI 文档，运行时不做校验）和对应的编码函数，
+编码函数的输入是只查询所需列的行元组，不构建 ORM 对象
+"""
+from typing_extensions import TypedDict
+
+from src.service.file_service import resolve_attachment_link
+from src.utils.datetime import format_datetime_to_minute
+from src.utils.money import amount_to_json
+
+
+class TicketItem(TypedDict):
+    id: int
+    amount: float | None
+    currency: str | None
+    merchant: str | None
+    description: str | None
+    attachmentUrl: str | None
+    thumbnailUrls: list[str | None]
+    paymentTime: str
+    userEmail: str | None
+    username: str | None
+    status: str
+    createdAt: str
+
+
+class TicketSearchItem(TicketItem):
+    rank: float
+
+
+class TicketListResponse(TypedDict):
+    data: list[TicketItem]
+    next_cursor: str | None
+    success: bool
+
+
+class TicketSearchResponse(TypedDict):
+    data: list[TicketSearchItem]
+    next_offset: int | None
+    success: bool
+
+
+class UserItem(TypedDict):
+    id: int
+    username: str | None
+    email: str | None
+    role: str
+    suspended: int
+    createdAt: str
+
+
+class UserSearchItem(UserItem):
+    rank: float
+
+
+class UserListResponse(TypedDict):
+    data: list[UserItem]
+    next_cursor: str | None
+    success: bool
+
+
+class UserSearchResponse(TypedDict):
+    data: list[UserSearchItem]
+    next_offset: int | None
+    success: bool
+
+
+def encode_ticket(row, thumbnail_urls: dict[str, str]) -> TicketItem:
+    """row has ticket_service.TICKET_LIST_COLUMNS, extra trailing columns are ignored"""
+    (ticket_id, amount, currency, merchant, description, attachment_link,
+     purchase_time, status, created_time, email, username) = row[:11]
+    return {
+        "id": ticket_id,
+        "amount": amount_to_json(amount),
+        "currency": currency,
+        "merchant": merchant,
+        "description": description,
+        "attachmentUrl": resolve_attachment_link(attachment_link),
+        "thumbnailUrls": [thumbnail_urls.get(reference) for reference in attachment_link.split(",") if reference]
+        if attachment_link else [],
+        "paymentTime": format_datetime_to_minute(purchase_time),
+        "userEmail": email,
+        "username": username,
+        "status": status.name,
+        "createdAt": format_datetime_to_minute(created_time),
+    }
+
+
+def encode_user(row) -> UserItem:
+    """row has user_service.USER_LIST_COLUMNS, extra trailing columns are ignored"""
+    user_id, username, email, group, deleted, created_time = row[:6]
+    return {
+        "id": user_id,
+        "username": username,
+        "email": email,
+        "role": group.name,
+        "suspended": deleted,
+        "createdAt": format_datetime_to_minute(created_time),
+    }
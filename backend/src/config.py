@@ -44,4 +44,24 @@ def auth_conf():
     return config.get("auth")
 
 
+def cache_conf():
+    return config.get("cache", {})
+
+
+def session_store_conf():
+    return config.get("session_store", {})
+
+
+def storage_conf():
+    return config.get("storage", {})
+
+
+def thumbnail_conf():
+    return config.get("thumbnail", {})
+
+
+def metrics_conf():
+    return config.get("metrics", {})
+
+
 load_config()
@@ -1,31 +1,41 @@
 import os
 from typing import List
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Depends
+from fastapi.responses import FileResponse, RedirectResponse, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.db.db_configs import open_read_session
+from src.db.modals.user import User
+from src.router.dependencies import SessionRoute, get_current_user, get_session, get_token_payload
 from src.service import file_service
+from src.utils.signature import verify_signature
+from src.utils.storage import storage, LocalStorage
+from src.utils.response import FastJSONResponse
 
-file_router = APIRouter(prefix="/api/files")
+file_router = APIRouter(prefix="/api/files", route_class=SessionRoute)
 
-TICKETS_UPLOAD_DIR = "attachments"
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
+MAX_FILE_COUNT = 6
 
-os.makedirs(TICKETS_UPLOAD_DIR, exist_ok=True)
+# attachments are content addressed and never change once uploaded
+ATTACHMENT_CACHE_CONTROL = "private, max-age=31536000, immutable"
 
 
 @file_router.post("/tickets/attachment")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(files: List[UploadFile] = File(...), db: AsyncSession = Depends(get_session)):
     """
     上传多个文件并返回URL列表（逗号分隔）
     """
     if not files:
         raise HTTPException(status_code=400, detail="没有上传文件")
 
-    urls_string, uploaded_urls = file_service.save_upload_file(files, "static",
-                                                               TICKETS_UPLOAD_DIR, MAX_FILE_SIZE)
+    if len(files) > MAX_FILE_COUNT:
+        raise HTTPException(status_code=400, detail=f"最多只能上传 {MAX_FILE_COUNT} 个文件")
 
-    return JSONResponse({
+    urls_string, uploaded_urls = await file_service.save_upload_file(db, files, MAX_FILE_SIZE)
+
+    return FastJSONResponse({
         "success": True,
         "data": {
             "message": f"成功上传 {len(uploaded_urls)} 个文件",
@@ -33,3 +43,59 @@ async def upload_files(files: List[UploadFile] = File(...)):
             "file_count": len(uploaded_urls)
         },
     })
+
+
+@file_router.get("/tickets/attachment/{sha256}")
+async def find_attachment(sha256: str, current_user: User = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_session)):
+    """
+    按 sha256 查询附件是否已上传，已上传时返回URL，客户端可跳过上传
+    只有有权限查看该附件时才返回带签名的 downloadUrl
+    """
+    url = await file_service.find_attachment_url(db, sha256)
+    if not url:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    data = {"url": url}
+    if await file_service.can_user_access_attachment(db, current_user, url):
+        data["downloadUrl"] = file_service.resolve_attachment_link(url)
+    return FastJSONResponse({
+        "success": True,
+        "data": data,
+    })
+
+
+@file_router.get("/attachments/{key:path}")
+async def download_attachment(key: str, request: Request, expires: int | None = None, signature: str | None = None):
+    """
+    下载附件，支持 ETag / If-None-Match 和 Range 请求
+    带有效签名的URL直接放行，否则需要登录且有权限查看附件所属的 ticket
+    """
+    reference = storage.reference(key)
+    if not verify_signature(key, expires, signature):
+        # signed downloads never touch the database, the session is only opened for the permission check
+        token_payload = await get_token_payload(request)
+        async with await open_read_session() as db:
+            user = await get_current_user(request, token_payload, db)
+            if not await file_service.can_user_access_attachment(db, user, reference):
+                raise HTTPException(status_code=403, detail="没有权限查看该文件")
+
+    if not isinstance(storage, LocalStorage):
+        return RedirectResponse(storage.download_url(reference), status_code=307)
+
+    path = storage.safe_path_of(key)
+    if not path or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    # file names are content hashes (or unique legacy names), so the name is a strong validator
+    etag = f'"{os.path.basename(path)}"'
+    headers = {"ETag": etag, "Cache-Control": ATTACHMENT_CACHE_CONTROL}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {item.strip().removeprefix("W/") for item in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+
+    # FileResponse answers Range requests and uses the server's zero-copy pathsend extension when available
+    return FileResponse(path, headers=headers)
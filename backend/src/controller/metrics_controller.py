@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from src.utils.metrics import registry
+
+metrics_router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus 文本格式的指标，只包含当前 worker 进程的数据
+    """
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
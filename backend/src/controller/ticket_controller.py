@@ -1,111 +1,296 @@
+import csv
+import io
 import logging
+from datetime import datetime
+from decimal import Decimal
 
-from fastapi import HTTPException, Request, APIRouter
+from fastapi import HTTPException, APIRouter, Query, Depends, UploadFile, File
 from fastapi.params import Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.common.business_error_code import ErrorCode
+from src.common.schemas import TicketItem, TicketListResponse, TicketSearchResponse, encode_ticket
+from src.db.db_enum import TicketStatus
 from src.db.modals.ticket import Ticket
-from src.service import ticket_service, user_service
-from src.service.user_service import is_email_existing, get_user_id_from_token
+from src.db.modals.user import User
+from src.router.dependencies import SessionRoute, get_current_user, get_session
+from src.service import ticket_service, summary_service, report_service
+from src.service.file_service import get_thumbnail_urls
 from src.utils.datetime import format_datetime_to_minute
+from src.utils.file import get_file_extension, iter_csv_records
+from src.utils.money import amount_to_json, parse_amount, parse_currency
+from src.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_SEARCH_OFFSET
+from src.utils.response import FastJSONResponse, dumps
 
-ticket_router = APIRouter(prefix="/api/tickets")
+ticket_router = APIRouter(prefix="/api/tickets", route_class=SessionRoute)
 
+MAX_BULK_SIZE = 1000
 
-@ticket_router.get("/")
-async def list_tickets(request: Request):
-    token = request.headers.get("Authorization")
-    user_id = await get_user_id_from_token(token)
 
-    if not user_id:
-        logging.error("Invalid or missing token.")
-        raise HTTPException(
-            status_code=401,
-            detail={"error": "Invalid token", "success": False, "error_code": ErrorCode.invalid_token}
-        )
-
-    user = await user_service.get_user_by_id(user_id)
-
-    if not user:
-        logging.error(f"User with ID {user_id} does not exist.")
+@ticket_router.get("/", responses={200: {"model": TicketListResponse}})
+async def list_tickets(current_user: User = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_session),
+                       limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       cursor: str | None = None,
+                       status: str | None = None,
+                       purchaser_id: int | None = None,
+                       min_amount: Decimal | None = None,
+                       max_amount: Decimal | None = None,
+                       created_from: datetime | None = None,
+                       created_to: datetime | None = None,
+                       sort: str = "-created_time"):
+    """
+    按 (created_time, id) 游标分页查询 ticket 列表，sort 取值 created_time / -created_time
+    """
+    ticket_status = TicketStatus.get_name(status) if status else None
+    if (status and ticket_status is None) or sort not in ("created_time", "-created_time"):
+        logging.error(f"Invalid ticket list parameters: status={status}, sort={sort}.")
         raise HTTPException(
             status_code=400,
-            detail={"error": "User not exist", "success": False, "error_code": ErrorCode.invalid_parameter}
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
         )
 
-    email = user.email
-
-    if not await is_email_existing(email):
-        logging.error(f"User with email {email} does not exist.")
+    try:
+        rows, next_cursor = await ticket_service.list_tickets_for_user(
+            db,
+            current_user,
+            limit=limit,
+            cursor=cursor,
+            status=ticket_status,
+            purchaser_id=purchaser_id,
+            min_amount=min_amount,
+            max_amount=max_amount,
+            created_from=created_from,
+            created_to=created_to,
+            descending=sort.startswith("-"),
+        )
+    except ValueError:
+        logging.error(f"Invalid cursor: {cursor}.")
         raise HTTPException(
             status_code=400,
-            detail={"error": "User not exist", "success": False, "error_code": ErrorCode.invalid_parameter}
+            detail={"error": "Invalid cursor", "success": False, "error_code": ErrorCode.invalid_parameter}
         )
 
-    tickets_with_user_info = await ticket_service.list_tickets_for_user(email)
-
-    if not isinstance(tickets_with_user_info, list):
-        logging.error(f"Failed to query tickets for user with email {email}.")
+    if not isinstance(rows, list):
+        logging.error(f"Failed to query tickets for user with id {current_user.id}.")
         raise HTTPException(
             status_code=500,
             detail={"error": "Query ticket list failed", "success": False, "error_code": ErrorCode.db_query_error}
         )
 
-    if len(tickets_with_user_info) == 0:
-        return JSONResponse(
+    if len(rows) == 0:
+        return FastJSONResponse(
             status_code=200,
             content={
                 "data": [],
+                "next_cursor": None,
                 "success": True
             }
         )
 
-    ticket_list = []
-    for ticket in tickets_with_user_info:
-        ticket_list.append({
-            "id": ticket.get("ticket").id,
-            "amount": ticket.get("ticket").amount,
-            "attachmentUrl": ticket.get("ticket").attachment_link,
-            "paymentTime": format_datetime_to_minute(ticket.get("ticket").purchase_time),
-            "userEmail": ticket.get("user_info").get("email"),
-            "username": ticket.get("user_info").get("username"),
-            "status": ticket.get("ticket").status.name,
-            "createdAt": format_datetime_to_minute(ticket.get("ticket").created_time),
-        })
-
-    return JSONResponse(
+    return FastJSONResponse(
+        status_code=200,
+        content={
+            "data": await _ticket_list(db, rows),
+            "next_cursor": next_cursor,
+            "success": True
+        }
+    )
+
+
+async def _ticket_list(db: AsyncSession, rows: list) -> list[TicketItem]:
+    # one query for the thumbnails of the whole page
+    attachment_references = [reference for row in rows
+                             for reference in (row.attachment_link or "").split(",")]
+    thumbnail_urls = await get_thumbnail_urls(db, attachment_references)
+
+    return [encode_ticket(row, thumbnail_urls) for row in rows]
+
+
+@ticket_router.get("/search", responses={200: {"model": TicketSearchResponse}})
+async def search_tickets(q: str = Query(..., min_length=1, max_length=100),
+                         limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                         offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+                         current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session)):
+    """
+    按商户、描述、报销人用户名 / 邮箱、金额搜索 ticket，按相关度排序分页
+    """
+    rows, next_offset = await ticket_service.search_tickets(db, current_user, q, limit, offset)
+
+    ticket_list = await _ticket_list(db, rows)
+    for item, row in zip(ticket_list, rows):
+        item["rank"] = row.rank
+
+    return FastJSONResponse(
         status_code=200,
         content={
             "data": ticket_list,
+            "next_offset": next_offset,
             "success": True
         }
     )
 
 
-@ticket_router.post("/")
-async def create_ticket(data: dict = Body(...), request: Request = None):
-    amount = data.get('amount', 0.0)
-    attachment_link = data.get('attachment_link', '')
+EXPORT_COLUMNS = ["id", "amount", "currency", "attachmentUrl", "paymentTime", "status", "createdAt", "userEmail",
+                  "username"]
+
+
+@ticket_router.get("/summary")
+async def ticket_summary(current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session),
+                         group_by: str = "status",
+                         status: str | None = None,
+                         purchaser_id: int | None = None,
+                         month_from: datetime | None = None,
+                         month_to: datetime | None = None):
+    """
+    ticket 汇总统计（数量、总额、平均值），group_by 为 status / user / month 中的一个或多个，逗号分隔
+    """
+    dimensions = list(dict.fromkeys(dimension.strip() for dimension in group_by.split(",") if dimension.strip()))
+    ticket_status = TicketStatus.get_name(status) if status else None
+    if (status and ticket_status is None) or not dimensions:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    try:
+        summaries = await summary_service.get_ticket_summary(db, current_user, dimensions, ticket_status,
+                                                             purchaser_id, month_from, month_to)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid group_by", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    return FastJSONResponse(status_code=200, content={"data": summaries, "success": True})
+
+
+@ticket_router.get("/report")
+async def amount_report(current_user: User = Depends(get_current_user),
+                        db: AsyncSession = Depends(get_session),
+                        currency: str | None = None,
+                        status: str | None = None,
+                        created_from: datetime | None = None,
+                        created_to: datetime | None = None,
+                        percentiles: str = "50,90,99"):
+    """
+    金额报表：总额、平均值、最大最小值、百分位数及每个用户的合计，同一币种内计算
+    """
+    ticket_status = TicketStatus.get_name(status) if status else None
+    try:
+        currency = parse_currency(currency)
+        percentile_values = [float(p) for p in percentiles.split(",") if p.strip()]
+        if (status and ticket_status is None) or not all(0 < p <= 100 for p in percentile_values):
+            raise ValueError("Invalid parameter")
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    report = await report_service.amount_report(db, current_user, currency, ticket_status, created_from,
+                                                created_to, percentile_values)
+    return FastJSONResponse(status_code=200, content={"data": report, "success": True})
+
+
+def _export_row(row) -> list:
+    ticket_id, amount, currency, attachment_link, purchase_time, status, created_time, email, username = row
+    return [ticket_id, amount_to_json(amount), currency, attachment_link, format_datetime_to_minute(purchase_time),
+            status.name, format_datetime_to_minute(created_time), email, username]
+
+
+async def _ndjson_chunks(chunks):
+    async for rows in chunks:
+        yield b"".join(dumps(dict(zip(EXPORT_COLUMNS, _export_row(row)))) + b"\n" for row in rows)
+
+
+async def _csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in chunks:
+        writer.writerows(_export_row(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    # header only when there is no row
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@ticket_router.get("/export")
+async def export_tickets(current_user: User = Depends(get_current_user),
+                         export_format: str = Query("ndjson", alias="format"),
+                         status: str | None = None,
+                         purchaser_id: int | None = None,
+                         min_amount: Decimal | None = None,
+                         max_amount: Decimal | None = None,
+                         created_from: datetime | None = None,
+                         created_to: datetime | None = None):
+    """
+    以 NDJSON 或 CSV 流式导出 ticket，内存占用与数据量无关
+    SessionRoute 在返回响应前结束请求的事务并归还连接，导出使用单独的只读会话，下载期间只占用一个连接
+    """
+    ticket_status = TicketStatus.get_name(status) if status else None
+    if (status and ticket_status is None) or export_format not in ("ndjson", "csv"):
+        logging.error(f"Invalid ticket export parameters: status={status}, format={export_format}.")
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    chunks = ticket_service.stream_tickets_for_user(
+        current_user,
+        status=ticket_status,
+        purchaser_id=purchaser_id,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        created_from=created_from,
+        created_to=created_to,
+    )
+
+    if export_format == "csv":
+        body, media_type = _csv_chunks(chunks), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _ndjson_chunks(chunks), "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=tickets.{export_format}"}
+    )
 
-    token = request.headers.get("Authorization")
-    user_id = await get_user_id_from_token(token)
 
-    if not user_id:
-        logging.error("Invalid or missing token.")
+@ticket_router.post("/")
+async def create_ticket(data: dict = Body(...), current_user: User = Depends(get_current_user),
+                        db: AsyncSession = Depends(get_session)):
+    try:
+        amount = parse_amount(data.get('amount'))
+        currency = parse_currency(data.get('currency'))
+    except ValueError as e:
         raise HTTPException(
-            status_code=401,
-            detail={"error": "Invalid token", "success": False, "error_code": ErrorCode.invalid_token}
+            status_code=400,
+            detail={"error": str(e), "success": False, "error_code": ErrorCode.invalid_parameter}
         )
+    attachment_link = data.get('attachment_link', '')
+    merchant = (data.get('merchant') or '').strip() or None
+    description = (data.get('description') or '').strip() or None
 
-    current_ticket = await ticket_service.create_ticket(user_id, amount, attachment_link)
+    current_ticket = await ticket_service.create_ticket(db, current_user, amount, attachment_link, currency,
+                                                        merchant, description)
     if isinstance(current_ticket, Ticket):
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=200,
             content={
                 "data": {
                     "ticket_id": current_ticket.id,
-                    "amount": current_ticket.amount,
+                    "amount": amount_to_json(current_ticket.amount),
+                    "currency": current_ticket.currency,
+                    "merchant": current_ticket.merchant,
+                    "description": current_ticket.description,
                     "attachment_link": current_ticket.attachment_link,
                     "purchase_time": format_datetime_to_minute(current_ticket.purchase_time),
                     "status": current_ticket.status.name
@@ -114,36 +299,148 @@ async def create_ticket(data: dict = Body(...), request: Request = None):
             }
         )
 
-    logging.error(f"Failed to create ticket for user with id {user_id}.")
+    logging.error(f"Failed to create ticket for user with id {current_user.id}.")
     raise HTTPException(
         status_code=500,
         detail={"error": "Creat ticket failed", "success": False, "error_code": ErrorCode.db_insert_error}
     )
 
 
-@ticket_router.put("/{ticket_id}/status")
-async def approve_ticket(ticket_id: int, data: dict = Body(...), request: Request = None):
-    status = data.get('status', '')
+@ticket_router.post("/batch")
+async def create_tickets(data: dict = Body(...), current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session)):
+    """
+    批量创建 ticket，body 为 {"tickets": [{"amount", "currency", "merchant", "description", "attachment_link",
+    "purchase_time"}, ...]}，
+    一个事务内多行插入，返回每一行的处理结果
+    """
+    tickets = data.get('tickets', [])
+    if (not isinstance(tickets, list) or not 0 < len(tickets) <= MAX_BULK_SIZE
+            or not all(isinstance(item, dict) for item in tickets)):
+        logging.error(f"Invalid batch create parameters from user with id {current_user.id}.")
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    results = await ticket_service.create_tickets(db, current_user, tickets)
+    return FastJSONResponse(
+        status_code=200,
+        content={
+            "data": {
+                "created_count": sum(1 for result in results if "ticket_id" in result),
+                "results": results,
+            },
+            "success": True
+        }
+    )
 
-    token = request.headers.get("Authorization")
-    user_id = await get_user_id_from_token(token)
 
-    if not user_id:
-        logging.error("Invalid or missing token.")
+@ticket_router.post("/import")
+async def import_tickets(file: UploadFile = File(...), current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session)):
+    """
+    从 CSV 导入 ticket，表头: amount,purchase_time,attachment_link[,currency,merchant,description,purchaser_email,status]，
+    文件按块读取解析，每 IMPORT_CHUNK_SIZE 行插入并提交一次，不会把整个文件读入内存
+    """
+    if get_file_extension(file.filename or "") != ".csv":
         raise HTTPException(
-            status_code=401,
-            detail={"error": "Invalid token", "success": False, "error_code": ErrorCode.invalid_token}
+            status_code=400,
+            detail={"error": "Only csv files are supported", "success": False,
+                    "error_code": ErrorCode.invalid_parameter}
         )
 
-    ticket = await ticket_service.approve_or_reject_ticket(ticket_id, status, user_id)
+    try:
+        summary = await ticket_service.import_tickets(db, current_user, iter_csv_records(file))
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "File must be utf-8 encoded", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+    except csv.Error as e:
+        # chunks before the invalid row are already imported
+        logging.error(f"Invalid csv imported by user with id {current_user.id}: {e}.")
+        raise HTTPException(
+            status_code=400,
+            detail={"error": f"Invalid csv, {e}", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    return FastJSONResponse(status_code=200, content={"data": summary, "success": True})
+
+
+@ticket_router.put("/status")
+async def bulk_approve_tickets(data: dict = Body(...), current_user: User = Depends(get_current_user),
+                               db: AsyncSession = Depends(get_session)):
+    """
+    批量审批 ticket，只有 PENDING 状态的 ticket 会被更新，返回每个 ticket 的处理结果
+    """
+    ticket_ids = data.get('ticket_ids', [])
+    status = TicketStatus.get_name(data.get('status', ''))
+
+    if (status not in (TicketStatus.APPROVED, TicketStatus.REJECTED) or not isinstance(ticket_ids, list)
+            or not 0 < len(ticket_ids) <= MAX_BULK_SIZE or not all(isinstance(i, int) for i in ticket_ids)):
+        logging.error(f"Invalid bulk approve parameters: status={data.get('status')}, count={len(ticket_ids)}.")
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    try:
+        outcomes = await ticket_service.bulk_approve_or_reject_tickets(db, ticket_ids, status, current_user)
+    except PermissionError:
+        logging.error(f"User with id {current_user.id} has no permission to approve tickets.")
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "Permission denied", "success": False, "error_code": ErrorCode.permission_denied}
+        )
+
+    return FastJSONResponse(
+        status_code=200,
+        content={
+            "data": {
+                "status": status.name,
+                "updated_count": sum(1 for outcome in outcomes.values() if outcome == "updated"),
+                "results": [{"ticket_id": ticket_id, "outcome": outcomes[ticket_id]} for ticket_id in ticket_ids],
+            },
+            "success": True
+        }
+    )
+
+
+@ticket_router.put("/{ticket_id}/status")
+async def approve_ticket(ticket_id: int, data: dict = Body(...), current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session)):
+    status = data.get('status', '')
+    if TicketStatus.get_name(status) is None:
+        logging.error(f"Invalid status {status} for ticket {ticket_id}.")
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+
+    try:
+        ticket = await ticket_service.approve_or_reject_ticket(db, ticket_id, status, current_user)
+    except PermissionError:
+        logging.error(f"User with id {current_user.id} has no permission to approve ticket {ticket_id}.")
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "Permission denied", "success": False, "error_code": ErrorCode.permission_denied}
+        )
+    except ValueError:
+        logging.error(f"Ticket {ticket_id} not found.")
+        raise HTTPException(
+            status_code=404,
+            detail={"error": "Ticket not found", "success": False, "error_code": ErrorCode.ticket_not_found}
+        )
 
     if isinstance(ticket, Ticket):
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=200,
             content={
                 "data": {
                     "ticket_id": ticket.id,
-                    "amount": ticket.amount,
+                    "amount": amount_to_json(ticket.amount),
+                    "currency": ticket.currency,
                     "attachment_link": ticket.attachment_link,
                     "purchase_time": format_datetime_to_minute(ticket.purchase_time),
                     "purchaser_id": ticket.purchaser_id,
@@ -1,27 +1,31 @@
 import logging
 import time
+from datetime import datetime
 
-from fastapi import HTTPException, Request, APIRouter
+from fastapi import HTTPException, Request, APIRouter, Depends, Query
 from fastapi.params import Body
-from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.common.business_error_code import ErrorCode
+from src.common.schemas import UserListResponse, UserSearchResponse, encode_user
 from src.common.validation import is_valid_email, is_valid_password, is_valid_username
 from src.db.modals.user import User
 from src.db.db_enum import UserGroup
+from src.router.dependencies import SessionRoute, get_current_user, get_session
 from src.service import user_service
 from src.utils import auth
-from src.service.user_service import is_email_existing, get_user_id_from_token
-from src.utils.datetime import format_datetime_to_minute
+from src.service.user_service import is_email_existing
+from src.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_SEARCH_OFFSET
+from src.utils.response import FastJSONResponse
 
-user_router = APIRouter(prefix="/api")
+user_router = APIRouter(prefix="/api", route_class=SessionRoute)
 
 
 @user_router.post("/login")
-async def login(data: dict = Body(...)):
+async def login(data: dict = Body(...), db: AsyncSession = Depends(get_session)):
     email = data.get('email', '')
     password = data.get('password', '')
-    current_user = await user_service.login(email, password)
+    current_user = await user_service.login(db, email, password)
 
     # invalid user
     if not isinstance(current_user, User):
@@ -32,7 +36,7 @@ async def login(data: dict = Body(...)):
         )
     token = auth.encode_auth_token(current_user.id, current_user.password,
                                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=200,
         content={
             "data": {
@@ -46,8 +50,22 @@ async def login(data: dict = Body(...)):
     )
 
 
+@user_router.post("/logout")
+async def logout(request: Request, current_user: User = Depends(get_current_user)):
+    await user_service.logout(request.state.token_payload)
+    return FastJSONResponse(
+        status_code=200,
+        content={
+            "data": {
+                "email": current_user.email
+            },
+            "success": True
+        }
+    )
+
+
 @user_router.post("/register")
-async def register(data: dict = Body(...)):
+async def register(data: dict = Body(...), db: AsyncSession = Depends(get_session)):
     email = data.get('email', '')
     password = data.get('password', '')
     username = data.get('username', '')
@@ -60,16 +78,16 @@ async def register(data: dict = Body(...)):
             detail={"error": "Invalid register data", "success": False, "error_code": ErrorCode.invalid_parameter}
         )
 
-    if await is_email_existing(email):
+    if await is_email_existing(db, email):
         logging.error(f"Registration failed: Email {email} already registered.")
         raise HTTPException(
             status_code=400,
             detail={"error": "Email already registered", "success": False, "error_code": ErrorCode.email_exist}
         )
 
-    current_user = await user_service.register(username, email, password, group)
+    current_user = await user_service.register(db, username, email, password, group)
     if isinstance(current_user, User):
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=200,
             content={
                 "data": {
@@ -88,77 +106,129 @@ async def register(data: dict = Body(...)):
     )
 
 
-@user_router.get("/user/list")
-async def list_users(request: Request = None):
-    token = request.headers.get("Authorization")
-    user_id = await get_user_id_from_token(token)
-
-    if not user_id:
-        logging.error("Invalid or missing token.")
+def _parse_user_filters(group: str | None) -> UserGroup | None:
+    user_group = UserGroup.get_name(group) if group else None
+    if group and user_group is None:
+        logging.error(f"Invalid user list parameters: group={group}.")
         raise HTTPException(
-            status_code=401,
-            detail={"error": "Invalid token", "success": False, "error_code": ErrorCode.invalid_token}
+            status_code=400,
+            detail={"error": "Invalid parameter", "success": False, "error_code": ErrorCode.invalid_parameter}
+        )
+    return user_group
+
+
+@user_router.get("/user/list", responses={200: {"model": UserListResponse}})
+async def list_users(current_user: User = Depends(get_current_user),
+                     db: AsyncSession = Depends(get_session),
+                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                     cursor: str | None = None,
+                     group: str | None = None,
+                     suspended: bool | None = None,
+                     created_from: datetime | None = None,
+                     created_to: datetime | None = None):
+    """
+    游标分页查询用户列表，未停用的用户在前，可按角色、停用状态和创建时间过滤
+    """
+    user_group = _parse_user_filters(group)
+    try:
+        rows, next_cursor = await user_service.list_users(db, current_user, limit, cursor, user_group, suspended,
+                                                           created_from, created_to)
+    except PermissionError:
+        logging.error(f"User with id {current_user.id} has no permission to list users.")
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "Permission denied", "success": False, "error_code": ErrorCode.permission_denied}
+        )
+    except ValueError:
+        logging.error(f"Invalid cursor: {cursor}.")
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid cursor", "success": False, "error_code": ErrorCode.invalid_parameter}
         )
 
-    users = await user_service.list_users(user_id)
+    user_list = [encode_user(row) for row in rows]
 
-    if not isinstance(users, list):
-        logging.error(f"Failed to query user list for user_id: {user_id}.")
+    return FastJSONResponse(
+        status_code=200,
+        content={
+            "data": user_list,
+            "next_cursor": next_cursor,
+            "success": True
+        }
+    )
+
+
+@user_router.get("/user/count")
+async def count_users(current_user: User = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_session),
+                      group: str | None = None,
+                      suspended: bool | None = None,
+                      created_from: datetime | None = None,
+                      created_to: datetime | None = None):
+    """
+    用户总数，无过滤条件且用户很多时返回估算值（estimated 为 true），结果短时间缓存
+    """
+    user_group = _parse_user_filters(group)
+    try:
+        count, estimated = await user_service.count_users(db, current_user, user_group, suspended,
+                                                          created_from, created_to)
+    except PermissionError:
+        logging.error(f"User with id {current_user.id} has no permission to count users.")
         raise HTTPException(
-            status_code=500,
-            detail={"error": "Query user list failed", "success": False, "error_code": ErrorCode.db_query_error}
+            status_code=403,
+            detail={"error": "Permission denied", "success": False, "error_code": ErrorCode.permission_denied}
         )
 
-    if len(users) == 0:
-        return JSONResponse(
-            status_code=200,
-            content={
-                "data": [],
-                "success": True
-            }
+    return FastJSONResponse(
+        status_code=200,
+        content={
+            "data": {"count": count, "estimated": estimated},
+            "success": True
+        }
+    )
+
+
+@user_router.get("/user/search", responses={200: {"model": UserSearchResponse}})
+async def search_users(q: str = Query(..., min_length=1, max_length=100),
+                       limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+                       current_user: User = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_session)):
+    """
+    按用户名 / 邮箱模糊搜索用户，按相似度排序分页
+    """
+    try:
+        rows, next_offset = await user_service.search_users(db, current_user, q, limit, offset)
+    except PermissionError:
+        logging.error(f"User with id {current_user.id} has no permission to search users.")
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "Permission denied", "success": False, "error_code": ErrorCode.permission_denied}
         )
 
-    user_list = [
-        {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "role": user.group.name,
-            "suspended": user.deleted,
-            "createdAt": format_datetime_to_minute(user.created_time)
-        } for user in users
-    ]
-
-    return JSONResponse(
+    user_list = [{**encode_user(row), "rank": row.rank} for row in rows]
+
+    return FastJSONResponse(
         status_code=200,
         content={
             "data": user_list,
+            "next_offset": next_offset,
             "success": True
         }
     )
 
 
-@user_router.put("/user/suspend")
-async def suspend_user(data: dict = Body(...), request: Request = None):
+@user_router.put("/user/suspend", dependencies=[Depends(get_current_user)])
+async def suspend_user(data: dict = Body(...), db: AsyncSession = Depends(get_session)):
     suspend_user_id = data.get('user_id')
     deleted = data.get('suspended')
 
-    token = request.headers.get("Authorization")
-    user_id = await get_user_id_from_token(token)
-
-    if not user_id:
-        logging.error("Invalid or missing token.")
-        raise HTTPException(
-            status_code=401,
-            detail={"error": "Invalid token", "success": False, "error_code": ErrorCode.invalid_token}
-        )
-
     # may need suspend reason in future
 
-    current_user = await user_service.suspend_user(suspend_user_id, deleted)
+    current_user = await user_service.suspend_user(db, suspend_user_id, deleted)
 
     if isinstance(current_user, User):
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=200,
             content={
                 "data": {
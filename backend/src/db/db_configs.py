@@ -1,25 +1,159 @@
+import logging
+import os
+import uuid
+
+from sqlalchemy import event, exc
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession
+from sqlalchemy.orm import Session
 
-from src.config import postgresql_db_conf
+from src.config import postgresql_db_conf, project_conf
+from src.db.db_metrics import InstrumentedAsyncQueuePool, instrument_engine
+from src.db.db_replicas import ReplicaSet, RecentWriters, current_user_id
+from src.utils.session_store import session_store
 
 host = postgresql_db_conf().get('host')
 user_name = postgresql_db_conf().get('userName')
 password = postgresql_db_conf().get('password')
 db_name = postgresql_db_conf().get('db_name')
 
-DATABASE_URL = f"postgresql+psycopg://{user_name}:{password}@{host}/{db_name}"
+# psycopg or asyncpg, init_db always uses psycopg since it needs a synchronous engine
+DRIVER = postgresql_db_conf().get('driver', 'psycopg')
+# behind PgBouncer in transaction pooling every transaction may run on a different server connection,
+# prepared statements can't be reused between transactions
+PGBOUNCER = postgresql_db_conf().get('pgbouncer', False)
+# prepared statements kept per connection, 0 disables them
+STATEMENT_CACHE_SIZE = postgresql_db_conf().get('statement_cache_size', 100)
+
+pool_conf = postgresql_db_conf().get('pool', {})
+# uvicorn reads the number of workers from WEB_CONCURRENCY when --workers is not given
+WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY') or project_conf().get('workers', 1)))
+# connections of all workers together, each worker gets an equal share unless pool.size is set
+MAX_CONNECTIONS = pool_conf.get('max_connections', 20)
+POOL_SIZE = pool_conf.get('size') or max(1, MAX_CONNECTIONS // WORKERS)
+POOL_MAX_OVERFLOW = pool_conf.get('max_overflow', 0)
+POOL_TIMEOUT = pool_conf.get('timeout_seconds', 10)  # fail fast instead of queueing requests behind a full pool
+POOL_RECYCLE = pool_conf.get('recycle_seconds', 1800)
+POOL_PRE_PING = pool_conf.get('pre_ping', True)  # detect connections closed by the server or PgBouncer
+
+replica_conf = postgresql_db_conf().get('replica', {})
+# hosts of the read replicas, same credentials and database name as the primary
+REPLICA_HOSTS = replica_conf.get('hosts', [])
+REPLICA_CHECK_INTERVAL = replica_conf.get('health_check_seconds', 10)
+REPLICA_MAX_LAG = replica_conf.get('max_lag_seconds', 30)
+# reads of a user stay on the primary this long after the user's last commit
+READ_YOUR_WRITES_SECONDS = replica_conf.get('read_your_writes_seconds', 10)
+
+# init_db holds a session level advisory lock around its DDL, so it has to reach postgres directly,
+# behind PgBouncer the lock, the DDL and the unlock could each run on a different server connection
+MIGRATION_HOST = postgresql_db_conf().get('migration_host') or host
+DATABASE_URL = f"postgresql+psycopg://{user_name}:{password}@{MIGRATION_HOST}/{db_name}"
+ASYNC_DATABASE_URL = f"postgresql+{DRIVER}://{user_name}:{password}@{host}/{db_name}"
+
+
+def driver_connect_args(driver: str) -> dict:
+    if driver == 'asyncpg':
+        if PGBOUNCER:
+            # no statement cache and unique statement names, see the SQLAlchemy asyncpg dialect docs
+            return {
+                'statement_cache_size': 0,
+                'prepared_statement_cache_size': 0,
+                'prepared_statement_name_func': lambda: f'__asyncpg_{uuid.uuid4()}__',
+            }
+        return {'prepared_statement_cache_size': STATEMENT_CACHE_SIZE}
+    # psycopg prepares a query on the server after it ran prepare_threshold (5) times, None never prepares
+    if PGBOUNCER or not STATEMENT_CACHE_SIZE:
+        return {'prepare_threshold': None}
+    return {}
+
+
+def _set_prepared_max(dbapi_connection, _):
+    # the size of psycopg's prepared statement cache is a connection attribute, not a connect argument
+    dbapi_connection.driver_connection.prepared_max = STATEMENT_CACHE_SIZE
+
+
+def create_pooled_engine(url: str, name: str):
+    """engine with the configured pool, name labels the pool in the metrics"""
+    engine = create_async_engine(
+        url,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,  # unit seconds
+        pool_recycle=POOL_RECYCLE,  # unit seconds
+        pool_pre_ping=POOL_PRE_PING,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_logging_name=name,
+        connect_args=driver_connect_args(DRIVER),
+    )
+    instrument_engine(engine)
+    if DRIVER == 'psycopg' and not PGBOUNCER and STATEMENT_CACHE_SIZE:
+        event.listen(engine.sync_engine, "connect", _set_prepared_max)
+    return engine
 
 
 # create SQLAlchemy engine and set connection pool for API call
-async_engine = create_async_engine(
-    DATABASE_URL,
-    pool_size=8,
-    max_overflow=2,
-    pool_timeout=30,  # unit seconds
-    pool_recycle=1800,  # unit seconds
-)
+async_engine = create_pooled_engine(ASYNC_DATABASE_URL, "primary")
+
+# pure reads run in READ ONLY transactions, the option is reset when the connection goes back to the pool
+read_only_engine = async_engine.execution_options(postgresql_readonly=True)
+
+replica_set = ReplicaSet({
+    f"replica{i}": create_pooled_engine(f"postgresql+{DRIVER}://{user_name}:{password}@{replica_host}/{db_name}",
+                                        f"replica{i}").execution_options(postgresql_readonly=True)
+    for i, replica_host in enumerate(REPLICA_HOSTS)
+}, REPLICA_CHECK_INTERVAL, REPLICA_MAX_LAG)
+replica_set.register_metrics()
+recent_writers = RecentWriters(session_store, READ_YOUR_WRITES_SECONDS)
+
+logging.info(f"Database pool: driver={DRIVER}, pgbouncer={PGBOUNCER}, workers={WORKERS}, size={POOL_SIZE}, "
+             f"max_overflow={POOL_MAX_OVERFLOW}, timeout={POOL_TIMEOUT}s, replicas={len(REPLICA_HOSTS)}")
+
+
+class PrimarySession(Session):
+    """sessions on the primary, a commit keeps the reads of the request's user on the primary for a while"""
+
+
+@event.listens_for(PrimarySession, "after_commit")
+def _after_commit(session):
+    session.info.setdefault("committed_writers", set()).update(session.info.pop("writers", ()))
+    session.info["committed_writers"].add(current_user_id.get())
+    for callback in session.info.pop("after_commit", ()):
+        callback()
+
 
-AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+@event.listens_for(PrimarySession, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("after_commit", None)
+    session.info.pop("writers", None)
+
+
+def after_commit(db: AsyncSession, callback):
+    """
+    run callback() once the transaction of db is committed, dropped when it rolls back,
+    e.g. cache invalidation, so no other request caches the old row between the flush and the commit
+    """
+    db.info.setdefault("after_commit", []).append(callback)
+
+
+def mark_writer(db: AsyncSession, user_id: int):
+    """
+    keep the reads of user_id on the primary once db is committed, for requests without a token yet,
+    e.g. register and login, the user of the request is marked anyway
+    """
+    db.info.setdefault("writers", set()).add(user_id)
+
+
+async def mark_recent_writers(db: AsyncSession):
+    """
+    store the users who committed through db in the session store, shared by all workers,
+    awaited right after the commit so the mark is set before the response is sent
+    """
+    writers = db.info.pop("committed_writers", None)
+    if replica_set and writers:
+        await recent_writers.mark(*writers)
+
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False, sync_session_class=PrimarySession)
+ReadSessionLocal = async_sessionmaker(expire_on_commit=False)
 
 
 async def get_db() -> AsyncSession:
@@ -29,3 +163,30 @@ async def get_db() -> AsyncSession:
         finally:
             await session.close()
 
+
+async def open_read_session() -> AsyncSession:
+    """
+    read-only session, on a healthy replica in round-robin, on the primary when no replica is configured
+    or healthy, when the replica can't be reached, or when the current user wrote recently
+    """
+    replica = replica_set.choose() if replica_set and not await recent_writers.contains(current_user_id.get()) else None
+    if replica is not None:
+        session = ReadSessionLocal(bind=replica.engine)
+        try:
+            # check out the connection now, so a dead replica falls back before any query ran
+            await session.connection()
+            return session
+        except (exc.DBAPIError, exc.TimeoutError, OSError) as e:
+            logging.error(f"Read replica {replica.name} unavailable, reading from the primary: {e}")
+            replica_set.mark_failed(replica)
+            await session.close()
+    return ReadSessionLocal(bind=read_only_engine)
+
+
+async def get_read_db() -> AsyncSession:
+    """session for pure reads outside the request's session, e.g. a streamed response body"""
+    async with await open_read_session() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
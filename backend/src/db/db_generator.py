@@ -1,19 +1,144 @@
 import logging
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text, Numeric, Float
+from sqlalchemy.schema import CreateColumn
 
 from src.db.modals.base_db import Base
-from src.db.db_configs import DATABASE_URL
+from src.db.modals.ticket_summary import TicketSummary
+from src.db.db_configs import DATABASE_URL, MIGRATION_HOST, PGBOUNCER, host
+from src.service.summary_service import ticket_summary_backfill
+
+# every uvicorn worker runs init_db on import, the advisory lock lets one worker migrate at a time,
+# the others wait and find nothing left to do
+INIT_DB_LOCK_ID = 0x7265696D  # arbitrary, unique per application in the database
+
+INDEX_VALIDITY_QUERY = text(
+    "SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+    "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = current_schema()"
+)
 
 
 def init_db():
-    # create synchronous engine for initialize
+    if PGBOUNCER and MIGRATION_HOST == host:
+        raise RuntimeError("db.postgresql.migration_host must point to the postgres server itself when "
+                           "connecting through PgBouncer, init_db needs a session level advisory lock")
+
+    # create synchronous engine for initialize, on a direct connection to postgres
     sync_engine = create_engine(DATABASE_URL)
 
-    logging.info("Initializing database and creating all tables if not exist...")
-    # create all table if not exist
-    Base.metadata.create_all(bind=sync_engine)
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block, use autocommit
+    with sync_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": INIT_DB_LOCK_ID})
+        try:
+            logging.info("Initializing database and creating all tables if not exist...")
+            existing_tables = set(inspect(connection).get_table_names())
+            # trigram indexes of the search need pg_trgm, creating it requires the CREATE privilege on the database
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            # create all table if not exist
+            Base.metadata.create_all(bind=connection)
+
+            logging.info("Dropping columns removed from the models...")
+            drop_removed_columns(connection)
+
+            logging.info("Adding missing columns to existing tables...")
+            upgraded_tables = upgrade_columns(connection)
+
+            logging.info("Converting float money columns to numeric...")
+            upgraded_tables |= upgrade_column_types(connection)
+
+            logging.info("Creating missing indexes on existing tables...")
+            upgrade_indexes(connection)
+
+            summary_table = TicketSummary.__table__
+            if summary_table.name not in existing_tables or summary_table.name in upgraded_tables:
+                # the summary is derived from the tickets, rebuild it instead of migrating it
+                logging.info("Filling the ticket summary table from existing tickets...")
+                summary_table.drop(bind=connection, checkfirst=True)
+                summary_table.create(bind=connection)
+                connection.execute(ticket_summary_backfill())
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": INIT_DB_LOCK_ID})
     logging.info("Database initialization completed.")
 
     # close engine after database change
     sync_engine.dispose()
+
+
+# table -> columns removed from the models, e.g. the stored search_vector replaced by an expression index
+REMOVED_COLUMNS = {
+    "ticket": ("search_vector",),
+}
+
+
+def drop_removed_columns(connection):
+    """DROP COLUMN only marks the column as dropped, no rewrite, its indexes are dropped with it"""
+    preparer = connection.dialect.identifier_preparer
+    for table_name, column_names in REMOVED_COLUMNS.items():
+        for column_name in column_names:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {preparer.quote(table_name)} DROP COLUMN IF EXISTS {preparer.quote(column_name)}"
+            )
+
+
+def upgrade_columns(connection):
+    """
+    create_all doesn't alter existing tables, columns added to the models later are added here,
+    new columns must be nullable or have a server default so the ALTER is a metadata only change
+    """
+    upgraded_tables = set()
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {connection.dialect.identifier_preparer.format_table(table)} "
+                f"ADD COLUMN IF NOT EXISTS {column_ddl}"
+            )
+            upgraded_tables.add(table.name)
+    return upgraded_tables
+
+
+def upgrade_column_types(connection):
+    """
+    money columns used to be float, convert them to the numeric type of the model,
+    this rewrites the table under an exclusive lock, so it runs once on the first start after upgrading
+    """
+    upgraded_tables = set()
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            # Float is a subclass of Numeric, only exact numeric model columns are converted
+            if (not isinstance(column.type, Numeric) or isinstance(column.type, Float)
+                    or not isinstance(existing.get(column.name), Float)):
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            column_name = preparer.format_column(column)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {preparer.format_table(table)} ALTER COLUMN {column_name} "
+                f"TYPE {column_type} USING round({column_name}::numeric, {column.type.scale})"
+            )
+            upgraded_tables.add(table.name)
+    return upgraded_tables
+
+
+def upgrade_indexes(connection):
+    """
+    create_all skips tables which already exist, so indexes added to the models later
+    are created here one by one, concurrently, without locking writes on the table,
+    a concurrent build that failed leaves an INVALID index behind, it is dropped and built again
+    """
+    validity = dict(connection.execute(INDEX_VALIDITY_QUERY).all())
+    preparer = connection.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if validity.get(index.name):
+                continue
+            if index.name in validity:
+                logging.error(f"Index {index.name} is invalid, building it again.")
+                connection.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {preparer.quote(index.name)}")
+            index.create(bind=connection)
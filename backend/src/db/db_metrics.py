@@ -0,0 +1,85 @@
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.utils.metrics import (registry, Gauge, current_request_stats, DB_QUERY_SECONDS, DB_QUERY_ERRORS,
+                               DB_POOL_CHECKOUT_SECONDS, DB_POOL_TIMEOUTS)
+
+STATEMENT_TYPES = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    the default pool of create_async_engine, records how long each checkout waits for a free connection,
+    labelled by the pool_logging_name of the engine, which also survives engine.dispose(),
+    and counts the checkouts of the current request
+    """
+
+    def _do_get(self):
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.checkouts += 1
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.inc(self.logging_name or "default")
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started, self.logging_name or "default")
+
+
+def _statement_type(statement: str) -> str:
+    verb = statement.lstrip()[:6].upper()
+    return verb if verb in STATEMENT_TYPES else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    DB_QUERY_SECONDS.observe(elapsed, _statement_type(statement))
+    # the greenlet running the query shares the context of the awaiting task, so this is the request's stats
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+    DB_QUERY_ERRORS.inc(_statement_type(exception_context.statement or ""))
+
+
+# pool name -> engine, pools are read at scrape time, dispose() replaces the pool object
+_engines: dict[str, AsyncEngine] = {}
+
+
+def _pool_stat(stat) -> dict:
+    return {(name,): stat(engine.sync_engine.pool) for name, engine in _engines.items()}
+
+
+registry.register(Gauge("db_pool_checked_out", "Connections in use.", ("pool",),
+                        collect=lambda: _pool_stat(lambda pool: pool.checkedout())))
+registry.register(Gauge("db_pool_idle", "Open connections waiting in the pool.", ("pool",),
+                        collect=lambda: _pool_stat(lambda pool: pool.checkedin())))
+# pool_size + max_overflow, checked_out / capacity is the saturation
+registry.register(Gauge("db_pool_capacity", "Maximum connections of the pool.", ("pool",),
+                        collect=lambda: _pool_stat(lambda pool: pool.size() + max(pool._max_overflow, 0))))
+
+
+def instrument_engine(engine: AsyncEngine):
+    """
+    query timing and counting hooks and pool gauges, the engine's pool_logging_name labels its pool
+    """
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+    _engines[sync_engine.pool.logging_name or "default"] = engine
@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.utils.metrics import registry, Gauge, current_request_stats
+
+# user of the current request, set by get_current_user, None for anonymous requests
+current_user_id: ContextVar[int | None] = ContextVar("current_user_id", default=None)
+
+# seconds the replica is behind the primary, 0 when it has replayed everything it received
+REPLICATION_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        # unknown until the first check, reads go to the primary meanwhile
+        self.healthy = False
+        self.lag: float | None = None
+        self.checked_at = 0.0
+        self.checking = False
+
+
+class ReplicaSet:
+    """
+    round-robin over the healthy read replicas, each replica is checked in the background at most every
+    check_interval seconds, a replica that is unreachable or lags more than max_lag seconds is skipped
+    until a later check passes
+    """
+
+    def __init__(self, engines: dict[str, AsyncEngine], check_interval: float = 10, max_lag: float = 30):
+        self.replicas = [Replica(name, engine) for name, engine in engines.items()]
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._counter = itertools.count()
+        self._tasks: set[asyncio.Task] = set()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def choose(self) -> Replica | None:
+        now = time.monotonic()
+        for replica in self.replicas:
+            if not replica.checking and now - replica.checked_at >= self.check_interval:
+                replica.checking = True
+                task = asyncio.create_task(self.check(replica))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    async def check(self, replica: Replica):
+        # the task copied the context of the request that scheduled it, the check is not the request's work
+        current_request_stats.set(None)
+        try:
+            async with replica.engine.connect() as connection:
+                replica.lag = float(await connection.scalar(REPLICATION_LAG_QUERY))
+            replica.healthy = replica.lag <= self.max_lag
+            if not replica.healthy:
+                logging.error(f"Read replica {replica.name} lags {replica.lag:.1f}s behind the primary, skipped.")
+        except Exception as e:
+            replica.healthy = False
+            logging.error(f"Read replica {replica.name} health check failed: {e}")
+        finally:
+            replica.checked_at = time.monotonic()
+            replica.checking = False
+
+    def mark_failed(self, replica: Replica):
+        """a connection to the replica failed, skip it until the next check"""
+        replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+    def register_metrics(self):
+        registry.register(Gauge(
+            "db_replica_healthy", "1 when the read replica receives reads.", ("pool",),
+            collect=lambda: {(replica.name,): int(replica.healthy) for replica in self.replicas},
+        ))
+        registry.register(Gauge(
+            "db_replica_lag_seconds", "Replication lag seen by the last health check.", ("pool",),
+            collect=lambda: {(replica.name,): replica.lag for replica in self.replicas if replica.lag is not None},
+        ))
+
+
+class RecentWriters:
+    """
+    users who committed a write on the primary in the last few seconds, their reads stay on the primary so they
+    see their own changes, kept in the session store so every worker routes the user's next request the same way
+    """
+
+    def __init__(self, store, seconds: float):
+        self.store = store
+        self.seconds = seconds
+
+    async def mark(self, *user_ids: int | None):
+        for user_id in user_ids:
+            if user_id is not None:
+                await self.store.mark_writer(user_id, self.seconds)
+
+    async def contains(self, user_id: int | None) -> bool:
+        return user_id is not None and await self.store.is_recent_writer(user_id)
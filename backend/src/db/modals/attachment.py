@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, String
+
+from src.db.modals.base_db import BaseDB
+
+
+class Attachment(BaseDB):
+    __tablename__ = 'attachment'
+    sha256 = Column(String(64), unique=True, index=True)  # content hash, identical files share one row
+    url = Column(String, unique=True)
+    size = Column(Integer)
+    ref_count = Column(Integer, default=0)  # number of tickets linking to this attachment
+    thumbnail_url = Column(String, nullable=True)  # filled by the thumbnail pipeline after upload
@@ -1,13 +1,51 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Enum, Index, text, func, cast, \
+    literal_column
+from sqlalchemy.dialects.postgresql import REGCONFIG
 
 from src.db.db_enum import TicketStatus
 from src.db.modals.base_db import BaseDB
+from src.utils.money import AMOUNT_PRECISION, AMOUNT_SCALE, DEFAULT_CURRENCY
+
+SEARCH_CONFIG = "simple"  # text search configuration of the search document and search queries
+
+
+def search_document(merchant, description):
+    """
+    full text document of merchant / description, 'simple' config doesn't stem, so it works for any language
+    indexed as an expression (no stored column, adding it needs no table rewrite), the search must use this same
+    expression with inlined constants so postgres matches it to ix_ticket_search_document
+    """
+    empty = literal_column("''")
+    return func.to_tsvector(
+        cast(literal_column(f"'{SEARCH_CONFIG}'"), REGCONFIG),
+        func.coalesce(merchant, empty).op("||")(literal_column("' '")).op("||")(func.coalesce(description, empty)),
+    )
 
 
 class Ticket(BaseDB):
     __tablename__ = 'ticket'
     purchase_time = Column(DateTime)
     purchaser_id = Column(Integer, ForeignKey("user.id"))
-    amount = Column(Float)
+    amount = Column(Numeric(AMOUNT_PRECISION, AMOUNT_SCALE))  # exact decimal, never float
+    currency = Column(String(3), default=DEFAULT_CURRENCY, server_default=DEFAULT_CURRENCY)  # ISO 4217 code
     attachment_link = Column(String)
     status = Column(Enum(TicketStatus), default=TicketStatus.PENDING.name)
+    merchant = Column(String, nullable=True)
+    description = Column(String, nullable=True)
+
+    __table_args__ = (
+        # employee listing, keyset on (created_time, id) per purchaser
+        Index("ix_ticket_purchaser_id_created_time", "purchaser_id", "created_time", "id",
+              postgresql_concurrently=True),
+        # employer listing and export, keyset on (created_time, id)
+        Index("ix_ticket_created_time_id", "created_time", "id", postgresql_concurrently=True),
+        # approver queue, only pending tickets are indexed
+        Index("ix_ticket_pending_created_time", "created_time", "id",
+              postgresql_where=text("status = 'PENDING'"), postgresql_concurrently=True),
+        # search: full text on merchant / description, trigram for partial merchant names, exact amount
+        Index("ix_ticket_search_document", search_document(merchant, description), postgresql_using="gin",
+              postgresql_concurrently=True),
+        Index("ix_ticket_merchant_trgm", "merchant", postgresql_using="gin",
+              postgresql_ops={"merchant": "gin_trgm_ops"}, postgresql_concurrently=True),
+        Index("ix_ticket_amount", "amount", postgresql_concurrently=True),
+    )
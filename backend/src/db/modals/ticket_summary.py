@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Enum, Index
+
+from src.db.db_enum import TicketStatus
+from src.db.modals.base_db import BaseDB
+from src.utils.money import AMOUNT_SCALE
+
+
+class TicketSummary(BaseDB):
+    """
+    ticket 汇总表，每个 (purchaser, 月份, 状态, 币种) 一行，在创建 ticket 和修改状态时增量维护
+    """
+    __tablename__ = 'ticket_summary'
+    purchaser_id = Column(Integer, ForeignKey("user.id"))
+    month = Column(DateTime)  # first moment of the purchase month, same as date_trunc('month', purchase_time)
+    status = Column(Enum(TicketStatus))
+    currency = Column(String(3))  # amounts of different currencies are never added up
+    ticket_count = Column(Integer, default=0)
+    total_amount = Column(Numeric(18, AMOUNT_SCALE), default=0)
+
+    __table_args__ = (
+        # upsert target of the incremental updates
+        Index("ux_ticket_summary_purchaser_month_status_currency", "purchaser_id", "month", "status", "currency",
+              unique=True),
+    )
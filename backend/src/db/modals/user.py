@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Enum
+from sqlalchemy import Column, String, Enum, Index, text
 
 from src.db.modals.base_db import BaseDB
 from src.db.db_enum import UserGroup
@@ -10,3 +10,20 @@ class User(BaseDB):
     email = Column(String, unique=True, index=True)
     password = Column(String)
     group = Column(Enum(UserGroup))
+
+    __table_args__ = (
+        # login and active user lookup by email
+        Index("ix_user_email_active", "email", postgresql_where=text("deleted = 0"),
+              postgresql_concurrently=True),
+        # search by partial or misspelled username / email, needs the pg_trgm extension
+        Index("ix_user_username_trgm", "username", postgresql_using="gin",
+              postgresql_ops={"username": "gin_trgm_ops"}, postgresql_concurrently=True),
+        Index("ix_user_email_trgm", "email", postgresql_using="gin",
+              postgresql_ops={"email": "gin_trgm_ops"}, postgresql_concurrently=True),
+    )
+
+
+# user list ordered by deleted asc, id desc, the index has the same mixed order so keyset pages are index scans
+Index("ix_user_deleted_id_desc", User.deleted, User.id.desc(), postgresql_concurrently=True)
+# filtered user list, e.g. all active employees
+Index("ix_user_group_deleted_id_desc", User.group, User.deleted, User.id.desc(), postgresql_concurrently=True)
@@ -1,14 +1,15 @@
 import logging
 
 from fastapi import FastAPI
-from starlette.staticfiles import StaticFiles
 
-from src.config import project_conf
+from src.config import project_conf, metrics_conf
 from src.controller.file_controller import file_router
-from src.router.router_config import add_cors_middleware
+from src.controller.metrics_controller import metrics_router
+from src.router.router_config import add_cors_middleware, add_metrics_middleware
 from src.controller.user_controller import user_router
 from src.controller.ticket_controller import ticket_router
 from src.db.db_generator import init_db
+from src.utils.response import FastJSONResponse
 
 
 def create_application() -> FastAPI:
@@ -18,11 +19,14 @@ def create_application() -> FastAPI:
     application = FastAPI(
         title=project_conf().get("project_name", "FastAPI Application"),
         version=project_conf().get("version"),
+        default_response_class=FastJSONResponse,
     )
 
     add_cors_middleware(application)
-
-    application.mount("/static", StaticFiles(directory=project_conf().get("static_files_path")), name="static")
+    if metrics_conf().get("enabled", True):
+        # added last so it is the outermost middleware and times everything else
+        add_metrics_middleware(application)
+        application.include_router(metrics_router)
 
     # 包含路由
 
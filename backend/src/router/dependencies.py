@@ -0,0 +1,107 @@
+import logging
+
+import jwt
+from fastapi import HTTPException, Request, Response, Depends
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.common.business_error_code import ErrorCode
+from src.db.db_configs import AsyncSessionLocal, open_read_session, mark_recent_writers
+from src.db.db_replicas import current_user_id
+from src.db.modals.user import User
+from src.service import user_service
+from src.utils.auth import decode_auth_token
+from src.utils.session_store import session_store
+
+# requests with these methods only read, their session runs a read-only transaction
+READ_ONLY_METHODS = {"GET", "HEAD"}
+
+
+async def get_token_payload(request: Request) -> dict | None:
+    """
+    解析 Authorization 头，无效或缺失时为 None
+    在打开数据库会话之前执行，读请求按当前用户选择主库或只读副本（read-your-writes）
+    """
+    token = request.headers.get("Authorization")
+
+    try:
+        payload = decode_auth_token(token.removeprefix("Bearer ")) if token else None
+    except jwt.InvalidTokenError:
+        payload = None
+
+    user_id = payload.get("data").get("id") if payload else None
+    current_user_id.set(user_id)
+    return payload
+
+
+async def get_session(request: Request, token_payload: dict | None = Depends(get_token_payload)) -> AsyncSession:
+    """
+    请求级数据库会话，同一请求的所有 service 共用一个会话和一个事务，只占用一个连接
+    接口返回后由 SessionRoute 在发送响应之前提交，抛出异常时回滚；
+    GET / HEAD 请求使用只读事务，有健康的只读副本时在副本上执行
+    """
+    # token_payload is resolved first, so the user is known when a replica is chosen
+    session = await open_read_session() if request.method in READ_ONLY_METHODS else AsyncSessionLocal()
+    async with session:
+        request.state.db_session = session
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            # this teardown runs after the response was sent, anything not committed by SessionRoute is dropped
+            request.state.db_session = None
+
+
+class SessionRoute(APIRoute):
+    """
+    提交请求级会话后再返回响应：fastapi 在响应发送之后才清理 yield 依赖，
+    在这里提交时，提交失败会返回 500，客户端收到响应后的请求一定能读到这次写入，
+    流式响应发送响应体之前连接也已经归还连接池
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            response = await handler(request)
+            session = getattr(request.state, "db_session", None)
+            if session is not None:
+                await session.commit()
+                await mark_recent_writers(session)
+            return response
+
+        return route_handler
+
+
+async def get_current_user(request: Request,
+                           token_payload: dict | None = Depends(get_token_payload),
+                           db: AsyncSession = Depends(get_session)) -> User:
+    """
+    校验 token 并查询当前用户，每个请求只查询一次
+    """
+    user_id = token_payload.get("data").get("id") if token_payload else None
+
+    # expiry is verified by jwt, revocation is a single lookup in session_store
+    if user_id and not await session_store.is_valid(token_payload.get("jti"), user_id, token_payload.get("iat")):
+        user_id = None
+
+    if not user_id:
+        logging.error("Invalid or missing token.")
+        raise HTTPException(
+            status_code=401,
+            detail={"error": "Invalid token", "success": False, "error_code": ErrorCode.invalid_token}
+        )
+
+    user = await user_service.get_user_by_id(db, user_id)
+
+    if not user:
+        logging.error(f"User with ID {user_id} does not exist.")
+        raise HTTPException(
+            status_code=401,
+            detail={"error": "User not exist", "success": False, "error_code": ErrorCode.no_user_found}
+        )
+
+    request.state.token_payload = token_payload
+    return user
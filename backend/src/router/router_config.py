@@ -1,8 +1,11 @@
 import logging
+import time
 
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.config import conf
+from src.utils.metrics import (RequestStats, current_request_stats, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_PROGRESS,
+                               REQUEST_DB_QUERIES, REQUEST_DB_SECONDS, REQUEST_DB_CHECKOUTS)
 
 
 def add_cors_middleware(app, origins=None):
@@ -19,3 +22,49 @@ def add_cors_middleware(app, origins=None):
         allow_methods=["*"],  # 可以指定所需 HTTP 方法，比如 ['GET', 'POST']
         allow_headers=["*"],  # 可以指定所需头部信息
     )
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and database queries / time of every request,
+    labelled by the route template (e.g. /api/tickets/{ticket_id}), requests no route matched share one label
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            current_request_stats.reset(token)
+            # the router puts the matched route into the scope
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.observe(elapsed, method, route, status)
+            REQUEST_DB_QUERIES.observe(stats.queries, method, route)
+            REQUEST_DB_SECONDS.observe(stats.query_seconds, method, route)
+            REQUEST_DB_CHECKOUTS.observe(stats.checkouts, method, route)
+
+
+def add_metrics_middleware(app):
+    app.add_middleware(MetricsMiddleware)
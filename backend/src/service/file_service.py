@@ -1,43 +1,90 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
 import os
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 from typing import List
 
 from fastapi import UploadFile
+from sqlalchemy import select, update, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.utils.file import is_allowed_file, generate_unique_filename
+from src.config import thumbnail_conf
+from src.db.db_configs import get_db, after_commit
+from src.db.db_enum import UserGroup
+from src.db.modals.attachment import Attachment
+from src.db.modals.ticket import Ticket
+from src.db.modals.user import User
+from src.utils.file import is_allowed_file, generate_unique_filename, get_file_extension, content_addressed_path
+from src.utils.metrics import UPLOAD_FILES, UPLOAD_BYTES, UPLOAD_SECONDS
+from src.utils.storage import storage
+from src.utils.thumbnail import can_render_thumbnail, render_thumbnail, thumbnail_key, THUMBNAIL_EXT
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
 
-async def save_upload_file(files: List[UploadFile], access_url_prefix, upload_dir, max_file_size=5 * 1024 * 1024) -> {str, int}:
-    uploaded_urls = []
-
-    for file in files:
-        try:
-            # 检查文件类型
-            if not is_allowed_file(file.filename):
-                raise Exception(f"文件类型不支持: {file.filename}")
+THUMBNAIL_ENABLED = thumbnail_conf().get("enabled", True)
+THUMBNAIL_MAX_SIZE = thumbnail_conf().get("max_size", 320)
+THUMBNAIL_WORKERS = thumbnail_conf().get("workers", 1)
 
-            # 生成唯一文件名
-            unique_filename = generate_unique_filename(file.filename)
-            file_path = os.path.join(upload_dir, unique_filename)
+_thumbnail_executor: ProcessPoolExecutor | None = None
+_background_tasks: set[asyncio.Task] = set()
 
-            # 读取并保存文件
-            content = await file.read()
 
-            # 检查文件大小
-            if len(content) > max_file_size:
-                raise Exception(f"文件过大: {file.filename} (最大 {max_file_size // 1024 // 1024}MB)")
+async def save_upload_file(db: AsyncSession, files: List[UploadFile],
+                           max_file_size=5 * 1024 * 1024) -> tuple[str, list[str]]:
+    """
+    文件先并发写入临时文件并计算哈希，再用请求的会话一次查询重复内容、一次插入新附件
+    """
+    started = time.perf_counter()
+    # 多个文件并发写入，结果顺序与上传顺序一致
+    staged = await asyncio.gather(
+        *(_stage_file(file, max_file_size) for file in files),
+        return_exceptions=True
+    )
 
-            # 保存文件
-            with open(file_path, "wb") as f:
-                f.write(content)
+    # 相同内容已上传过，直接返回已有的URL
+    digests = {result[0] for result in staged if not isinstance(result, BaseException)}
+    existing_urls = await find_attachment_urls(db, digests)
 
-            # 生成访问URL（根据您的实际域名调整）
-            file_url = f"{access_url_prefix}/{unique_filename}"
-            uploaded_urls.append(file_url)
+    # 按内容哈希分片存放，相同内容的文件只保存一份，同一次上传里重复的文件也只保存一次
+    new_files = {}
+    for file, result in zip(files, staged):
+        if not isinstance(result, BaseException) and result[0] not in existing_urls:
+            new_files.setdefault(result[0], (file, result))
+    stored_results = dict(zip(new_files, await asyncio.gather(
+        *(_store_file(file, digest, tmp_path) for digest, (file, (_, tmp_path, _)) in new_files.items()),
+        return_exceptions=True
+    )))
+    new_attachments = [(digest, url, new_files[digest][1][2]) for digest, url in stored_results.items()
+                       if not isinstance(url, BaseException)]
+    if new_attachments:
+        await _register_attachments(db, new_attachments)
 
-        except Exception as e:
+    uploaded_urls = []
+    for file, result in zip(files, staged):
+        written = 0
+        if not isinstance(result, BaseException):
+            digest, tmp_path, written = result
+            outcome = "stored" if new_files.get(digest, (None,))[0] is file else "duplicate"
+            if outcome == "duplicate":
+                await _remove_file(tmp_path)
+            result = existing_urls.get(digest) or stored_results[digest]
+        if isinstance(result, BaseException):
+            outcome = "rejected" if isinstance(result, ValueError) else "failed"
             # 如果某个文件上传失败，继续处理其他文件
-            print(f"文件上传失败 {file.filename}: {str(e)}")
-            continue
+            logging.error(f"文件上传失败 {file.filename}: {str(result)}")
+        else:
+            uploaded_urls.append(result)
+        UPLOAD_FILES.inc(outcome)
+        UPLOAD_BYTES.inc(outcome, amount=written)
+        UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome)
 
     if not uploaded_urls:
         raise Exception("文件上传失败")
@@ -46,3 +93,217 @@ async def save_upload_file(files: List[UploadFile], access_url_prefix, upload_di
     urls_string = ",".join(uploaded_urls)
 
     return urls_string, uploaded_urls
+
+
+def _write_chunk(output, hasher, chunk: bytes):
+    hasher.update(chunk)
+    output.write(chunk)
+
+
+async def _remove_file(path: str):
+    if os.path.exists(path):
+        await asyncio.to_thread(os.remove, path)
+
+
+async def _stage_file(file: UploadFile, max_file_size) -> tuple[str, str, int]:
+    """
+    写入临时文件，返回 (sha256, 临时文件路径, 大小)
+    """
+    # 检查文件类型
+    if not is_allowed_file(file.filename):
+        raise ValueError(f"文件类型不支持: {file.filename}")
+
+    # 已知大小时直接拒绝，不读取内容
+    if file.size is not None and file.size > max_file_size:
+        raise ValueError(f"文件过大: {file.filename} (最大 {max_file_size // 1024 // 1024}MB)")
+
+    # 先写入临时文件，边写边计算哈希
+    tmp_path = os.path.join(storage.tmp_dir, generate_unique_filename(file.filename))
+
+    # 分块读取并写入，磁盘 IO 和哈希计算放到线程中执行，不阻塞事件循环
+    hasher = hashlib.sha256()
+    written = 0
+    output = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                # 边写边检查文件大小，超出后立即中止
+                if written > max_file_size:
+                    raise ValueError(f"文件过大: {file.filename} (最大 {max_file_size // 1024 // 1024}MB)")
+                await asyncio.to_thread(_write_chunk, output, hasher, chunk)
+        finally:
+            await asyncio.to_thread(output.close)
+    except BaseException:
+        # 删除写了一半的临时文件
+        await _remove_file(tmp_path)
+        raise
+    return hasher.hexdigest(), tmp_path, written
+
+
+async def _store_file(file: UploadFile, digest: str, tmp_path: str) -> str:
+    key = content_addressed_path(digest, get_file_extension(file.filename))
+    try:
+        await storage.save_file(tmp_path, key, file.content_type)
+    except BaseException:
+        await _remove_file(tmp_path)
+        raise
+    return storage.reference(key)
+
+
+def _schedule_thumbnail(key: str):
+    if not THUMBNAIL_ENABLED or not can_render_thumbnail(get_file_extension(key)):
+        return
+    task = asyncio.create_task(generate_thumbnail(key))
+    # keep a reference until the task is done, otherwise it may be garbage collected
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _get_thumbnail_executor() -> ProcessPoolExecutor:
+    global _thumbnail_executor
+    if _thumbnail_executor is None:
+        # spawn instead of fork, the server process already runs threads
+        _thumbnail_executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+    return _thumbnail_executor
+
+
+async def generate_thumbnail(key: str):
+    """
+    render the thumbnail in the process pool, store it next to the original and record it on the attachment
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        async with storage.local_copy(key) as source_path:
+            content = await loop.run_in_executor(_get_thumbnail_executor(), render_thumbnail,
+                                                 source_path, get_file_extension(key), THUMBNAIL_MAX_SIZE)
+        if not content:
+            return
+
+        tmp_path = os.path.join(storage.tmp_dir, uuid.uuid4().hex + THUMBNAIL_EXT)
+        await asyncio.to_thread(_write_file, tmp_path, content)
+        await storage.save_file(tmp_path, thumbnail_key(key), "image/jpeg")
+
+        async for db in get_db():
+            await db.execute(
+                update(Attachment).where(Attachment.url == storage.reference(key)).values(
+                    thumbnail_url=storage.reference(thumbnail_key(key)), updated_time=datetime.now()
+                )
+            )
+            await db.commit()
+    except BrokenProcessPool as e:
+        # a crashed worker breaks the whole pool, create a new one for the next thumbnail
+        global _thumbnail_executor
+        _thumbnail_executor = None
+        logging.error(f"缩略图生成失败 {key}: {str(e)}")
+    except Exception as e:
+        logging.error(f"缩略图生成失败 {key}: {str(e)}")
+
+
+def _write_file(path: str, content: bytes):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+async def _register_attachments(db: AsyncSession, attachments: list[tuple[str, str, int]]):
+    """
+    插入新上传的附件 (sha256, url, size)，在调用方的事务中执行，提交后再生成缩略图
+    """
+    now = datetime.now()
+    await db.execute(
+        insert(Attachment).values([
+            {"sha256": sha256, "url": url, "size": size, "ref_count": 0, "created_time": now, "updated_time": now}
+            for sha256, url, size in attachments
+        ]).on_conflict_do_nothing(index_elements=[Attachment.sha256])
+    )
+    for _, url, _ in attachments:
+        # the thumbnail task updates the row in a session of its own, so it starts after the commit
+        after_commit(db, lambda key=storage.key_of(url): _schedule_thumbnail(key))
+
+
+async def find_attachment_url(db: AsyncSession, sha256: str) -> str | None:
+    """
+    按内容哈希查询已上传的附件，客户端可以先查询，已存在时无需再次上传
+    """
+    result = await db.execute(
+        select(Attachment.url).where(Attachment.sha256 == sha256.lower())
+    )
+    return result.scalar_one_or_none()
+
+
+async def find_attachment_urls(db: AsyncSession, digests: set[str]) -> dict[str, str]:
+    """
+    batch query uploaded attachments by content hash, returns {sha256: url}
+    """
+    if not digests:
+        return {}
+    result = await db.execute(
+        select(Attachment.sha256, Attachment.url).where(Attachment.sha256.in_(digests))
+    )
+    return dict(result.all())
+
+
+async def add_attachment_references(db, *attachment_links: str, delta: int = 1):
+    """
+    update ref_count of attachments linked by one or more tickets, each attachment_link is comma separated,
+    runs in the caller's transaction with one UPDATE per distinct reference count
+    """
+    counts = Counter(url for attachment_link in attachment_links if attachment_link
+                     for url in set(attachment_link.split(",")) if url)
+    urls_by_count = {}
+    for url, count in counts.items():
+        urls_by_count.setdefault(count, []).append(url)
+    for count, urls in urls_by_count.items():
+        await db.execute(
+            update(Attachment).where(Attachment.url.in_(urls)).values(ref_count=Attachment.ref_count + count * delta)
+        )
+
+
+def resolve_attachment_link(attachment_link: str | None) -> str:
+    """
+    convert stored attachment references to download urls, e.g. presigned urls for S3
+    """
+    if not attachment_link:
+        return attachment_link
+    return ",".join(storage.download_url(reference) if reference else reference
+                    for reference in attachment_link.split(","))
+
+
+async def get_thumbnail_urls(db: AsyncSession, references: list[str]) -> dict[str, str]:
+    """
+    batch query thumbnails of attachment references, returns {reference: thumbnail download url}
+    """
+    references = [reference for reference in set(references) if reference]
+    if not references:
+        return {}
+    result = await db.execute(
+        select(Attachment.url, Attachment.thumbnail_url).where(
+            Attachment.url.in_(references), Attachment.thumbnail_url.is_not(None)
+        )
+    )
+    return {url: storage.download_url(thumbnail_url) for url, thumbnail_url in result.all()}
+
+
+async def can_user_access_attachment(db: AsyncSession, user: User, reference: str) -> bool:
+    """
+    employers can see every attachment, employees only the attachments of their own tickets
+    """
+    if user.group == UserGroup.EMPLOYER:
+        return True
+
+    references = [reference]
+    if reference.endswith(THUMBNAIL_EXT):
+        # a thumbnail is visible when its original attachment is
+        result = await db.execute(
+            select(Attachment.url).where(Attachment.thumbnail_url == reference)
+        )
+        references.extend(result.scalars().all())
+
+    result = await db.execute(
+        select(Ticket.id).where(
+            Ticket.purchaser_id == user.id,
+            or_(*(Ticket.attachment_link.contains(item, autoescape=True) for item in references))
+        ).limit(1)
+    )
+    return result.scalar_one_or_none() is not None
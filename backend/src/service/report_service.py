@@ -0,0 +1,128 @@
+import math
+from array import array
+from datetime import datetime
+
+from sqlalchemy import select, cast, BigInteger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.db_enum import TicketStatus, UserGroup
+from src.db.modals.ticket import Ticket
+from src.db.modals.user import User
+from src.utils.money import DEFAULT_CURRENCY, MINOR_UNITS, from_minor_units, amount_to_json
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, reports fall back to plain python over the same arrays
+    numpy = None
+
+REPORT_CHUNK_SIZE = 10000
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+async def load_amounts(db: AsyncSession, user: User, currency: str = DEFAULT_CURRENCY,
+                       status: TicketStatus | None = None, created_from: datetime | None = None,
+                       created_to: datetime | None = None) -> tuple[array, array]:
+    """
+    load (purchaser_id, amount) of the matching tickets into two int64 arrays, amounts in minor units,
+    8 bytes per value instead of one ORM object per ticket, rows are streamed with a server side cursor
+    """
+    # both columns are nullable, an int64 array can't hold NULL, such rows are left out of the report
+    query = select(Ticket.purchaser_id, cast(Ticket.amount * MINOR_UNITS, BigInteger)).where(
+        Ticket.deleted == 0, Ticket.currency == currency,
+        Ticket.purchaser_id.is_not(None), Ticket.amount.is_not(None)
+    )
+    if user.group != UserGroup.EMPLOYER:
+        query = query.where(Ticket.purchaser_id == user.id)
+    if status is not None:
+        query = query.where(Ticket.status == status)
+    if created_from is not None:
+        query = query.where(Ticket.created_time >= created_from)
+    if created_to is not None:
+        query = query.where(Ticket.created_time < created_to)
+
+    purchaser_ids = array("q")
+    amounts = array("q")
+    result = await db.stream(query.execution_options(yield_per=REPORT_CHUNK_SIZE))
+    async for rows in result.partitions():
+        purchaser_ids.extend(row[0] for row in rows)
+        amounts.extend(row[1] for row in rows)
+    return purchaser_ids, amounts
+
+
+def _rank(count: int, percentile: float) -> int:
+    """nearest rank percentile, index into the sorted values"""
+    return max(0, math.ceil(percentile / 100 * count) - 1)
+
+
+def _summarize_numpy(purchaser_ids: array, amounts: array, percentiles) -> tuple:
+    values = numpy.frombuffer(amounts, dtype=numpy.int64)
+    ids = numpy.frombuffer(purchaser_ids, dtype=numpy.int64)
+
+    ranks = [_rank(len(values), p) for p in percentiles]
+    # partial sort, only the requested ranks are put in place
+    partitioned = numpy.partition(values, ranks)
+    percentile_values = [int(partitioned[rank]) for rank in ranks]
+
+    # group by purchaser: sort once, then add up each run of equal ids, all in int64
+    order = numpy.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    starts = numpy.flatnonzero(numpy.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+    totals = numpy.add.reduceat(values[order], starts)
+    counts = numpy.diff(numpy.append(starts, len(values)))
+    per_user = zip(sorted_ids[starts].tolist(), counts.tolist(), totals.tolist())
+
+    return int(values.sum()), int(values.min()), int(values.max()), percentile_values, per_user
+
+
+def _summarize_python(purchaser_ids: array, amounts: array, percentiles) -> tuple:
+    ordered = sorted(amounts)
+    percentile_values = [ordered[_rank(len(ordered), p)] for p in percentiles]
+
+    per_user = {}
+    for purchaser_id, amount in zip(purchaser_ids, amounts):
+        count, total = per_user.get(purchaser_id, (0, 0))
+        per_user[purchaser_id] = (count + 1, total + amount)
+    per_user = ((purchaser_id, count, total) for purchaser_id, (count, total) in per_user.items())
+
+    return sum(amounts), ordered[0], ordered[-1], percentile_values, per_user
+
+
+def summarize_amounts(purchaser_ids: array, amounts: array, percentiles=DEFAULT_PERCENTILES) -> dict:
+    """
+    total, mean, min, max, percentiles and per purchaser totals of amounts in minor units,
+    computed with integer arithmetic so the totals are exact, vectorized when numpy is installed
+    """
+    if not amounts:
+        return {"ticket_count": 0, "total_amount": 0, "average_amount": None, "min_amount": None,
+                "max_amount": None, "percentiles": {}, "per_user": []}
+
+    summarize = _summarize_numpy if numpy is not None else _summarize_python
+    total, minimum, maximum, percentile_values, per_user = summarize(purchaser_ids, amounts, percentiles)
+    count = len(amounts)
+    # largest totals first
+    per_user = sorted(per_user, key=lambda item: (-item[2], item[0]))
+    return {
+        "ticket_count": count,
+        "total_amount": amount_to_json(from_minor_units(total)),
+        # rounded half up to the minor unit
+        "average_amount": amount_to_json(from_minor_units((2 * total + count) // (2 * count))),
+        "min_amount": amount_to_json(from_minor_units(minimum)),
+        "max_amount": amount_to_json(from_minor_units(maximum)),
+        "percentiles": {f"p{p:g}": amount_to_json(from_minor_units(value))
+                        for p, value in zip(percentiles, percentile_values)},
+        "per_user": [{"purchaser_id": purchaser_id, "ticket_count": user_count,
+                      "total_amount": amount_to_json(from_minor_units(user_total))}
+                     for purchaser_id, user_count, user_total in per_user],
+    }
+
+
+async def amount_report(db: AsyncSession, user: User, currency: str = DEFAULT_CURRENCY,
+                        status: TicketStatus | None = None, created_from: datetime | None = None,
+                        created_to: datetime | None = None, percentiles=DEFAULT_PERCENTILES) -> dict:
+    """
+    金额统计报表，employees only see their own tickets
+    """
+    purchaser_ids, amounts = await load_amounts(db, user, currency, status, created_from, created_to)
+    report = summarize_amounts(purchaser_ids, amounts, percentiles)
+    report["currency"] = currency
+    return report
@@ -0,0 +1,163 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import select, func, delete, literal, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.db_configs import get_db
+from src.db.db_enum import TicketStatus, UserGroup
+from src.db.modals.ticket import Ticket
+from src.db.modals.ticket_summary import TicketSummary
+from src.db.modals.user import User
+from src.utils.money import CENT, amount_to_json
+
+SUMMARY_DIMENSIONS = ("status", "user", "month")
+
+
+def month_of(value: datetime) -> datetime:
+    """python 端与 date_trunc('month', ...) 一致的月份"""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+async def apply_summary_changes(db, changes):
+    """
+    apply (purchaser_id, purchase_time, status, currency, count, amount) deltas to the summary table in the caller's
+    transaction, deltas of the same row are merged and written with one INSERT ... ON CONFLICT DO UPDATE
+    """
+    merged = defaultdict(lambda: [0, Decimal(0)])
+    for purchaser_id, purchase_time, status, currency, count, amount in changes:
+        delta = merged[(purchaser_id, month_of(purchase_time), status, currency)]
+        delta[0] += count
+        delta[1] += amount * count
+    merged = {key: delta for key, delta in merged.items() if delta[0]}
+    if not merged:
+        return
+
+    now = datetime.now()
+    # rows are locked in key order, concurrent transactions touching the same rows can't deadlock
+    values = [{
+        "purchaser_id": purchaser_id, "month": month, "status": status, "currency": currency,
+        "ticket_count": count, "total_amount": amount,
+        "created_time": now, "updated_time": now, "deleted": 0,
+    } for (purchaser_id, month, status, currency), (count, amount) in sorted(merged.items(), key=lambda item: (
+        item[0][0], item[0][1], item[0][2].name, item[0][3]))]
+    statement = insert(TicketSummary).values(values)
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[TicketSummary.purchaser_id, TicketSummary.month, TicketSummary.status,
+                            TicketSummary.currency],
+            set_={
+                "ticket_count": TicketSummary.ticket_count + statement.excluded.ticket_count,
+                "total_amount": TicketSummary.total_amount + statement.excluded.total_amount,
+                "updated_time": now,
+            }
+        )
+    )
+
+
+async def record_tickets_created(db, tickets):
+    """tickets: iterable of (purchaser_id, purchase_time, status, currency, amount)"""
+    await apply_summary_changes(db, ((purchaser_id, purchase_time, status, currency, 1, amount)
+                                     for purchaser_id, purchase_time, status, currency, amount in tickets))
+
+
+async def record_status_changed(db, tickets):
+    """tickets: iterable of (purchaser_id, purchase_time, currency, amount, old_status, new_status)"""
+    changes = []
+    for purchaser_id, purchase_time, currency, amount, old_status, new_status in tickets:
+        if old_status == new_status:
+            continue
+        # tickets without a status are not summarized
+        if old_status is not None:
+            changes.append((purchaser_id, purchase_time, old_status, currency, -1, amount))
+        if new_status is not None:
+            changes.append((purchaser_id, purchase_time, new_status, currency, 1, amount))
+    await apply_summary_changes(db, changes)
+
+
+def ticket_summary_backfill():
+    """INSERT ... SELECT rebuilding the summary table from the ticket table"""
+    # inline literal, a bound parameter in both SELECT and GROUP BY isn't recognized as the same expression
+    month = func.date_trunc(literal_column("'month'"), Ticket.purchase_time)
+    now = func.now()
+    return insert(TicketSummary).from_select(
+        ["purchaser_id", "month", "status", "currency", "ticket_count", "total_amount", "created_time",
+         "updated_time", "deleted"],
+        select(Ticket.purchaser_id, month, Ticket.status, Ticket.currency, func.count(),
+               func.coalesce(func.sum(Ticket.amount), 0), now, now, literal(0)).
+        where(Ticket.deleted == 0, Ticket.status.is_not(None)).
+        group_by(Ticket.purchaser_id, month, Ticket.status, Ticket.currency)
+    )
+
+
+async def rebuild_ticket_summary():
+    """重新计算整个汇总表，用于数据修复"""
+    async for db in get_db():
+        try:
+            await db.execute(delete(TicketSummary))
+            await db.execute(ticket_summary_backfill())
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            raise e
+
+
+async def get_ticket_summary(db: AsyncSession, user: User, group_by: list[str], status: TicketStatus | None = None,
+                             purchaser_id: int | None = None, month_from: datetime | None = None,
+                             month_to: datetime | None = None) -> list[dict]:
+    """
+    totals, counts and averages grouped by any of status / user / month and always by currency,
+    read from the summary table, the cost depends on the number of users and months, not on the number of tickets
+    employees only see the summary of their own tickets
+    """
+    if any(dimension not in SUMMARY_DIMENSIONS for dimension in group_by):
+        raise ValueError("Unknown summary dimension")
+
+    columns = {
+        "status": [TicketSummary.status],
+        "user": [TicketSummary.purchaser_id, User.username],
+        "month": [TicketSummary.month],
+    }
+    group_columns = [column for dimension in group_by for column in columns[dimension]] + [TicketSummary.currency]
+    ticket_count = func.sum(TicketSummary.ticket_count)
+    total_amount = func.sum(TicketSummary.total_amount)
+
+    query = select(*group_columns, ticket_count, total_amount).select_from(TicketSummary)
+    if "user" in group_by:
+        query = query.join(User, User.id == TicketSummary.purchaser_id)
+    if user.group != UserGroup.EMPLOYER:
+        query = query.where(TicketSummary.purchaser_id == user.id)
+    elif purchaser_id is not None:
+        query = query.where(TicketSummary.purchaser_id == purchaser_id)
+    if status is not None:
+        query = query.where(TicketSummary.status == status)
+    if month_from is not None:
+        query = query.where(TicketSummary.month >= month_of(month_from))
+    if month_to is not None:
+        query = query.where(TicketSummary.month <= month_of(month_to))
+    query = query.group_by(*group_columns).having(ticket_count > 0).order_by(*group_columns)
+
+    result = await db.execute(query)
+    summaries = []
+    for row in result.all():
+        *keys, currency, count, total = row
+        item = {}
+        keys = iter(keys)
+        for dimension in group_by:
+            if dimension == "status":
+                item["status"] = next(keys).name
+            elif dimension == "user":
+                item["purchaser_id"] = next(keys)
+                item["purchaser_name"] = next(keys)
+            else:
+                item["month"] = next(keys).strftime("%Y-%m")
+        item.update({
+            "currency": currency,
+            "ticket_count": count,
+            "total_amount": amount_to_json(total),
+            "average_amount": amount_to_json((total / count).quantize(CENT)),
+        })
+        summaries.append(item)
+    return summaries
@@ -1,100 +1,409 @@
 from datetime import datetime
+from decimal import Decimal
 
-from sqlalchemy import select, and_
+from sqlalchemy import select, tuple_, update, insert, any_, bindparam, Integer, func, or_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.db.db_configs import get_db
+from src.db.db_configs import get_read_db
 from src.db.db_enum import TicketStatus, UserGroup
-from src.db.modals.ticket import Ticket
+from src.db.modals.ticket import Ticket, SEARCH_CONFIG, search_document
 from src.db.modals.user import User
+from src.service.file_service import add_attachment_references
+from src.service.summary_service import record_tickets_created, record_status_changed
+from src.utils.datetime import to_naive_local
+from src.utils.money import DEFAULT_CURRENCY, parse_amount, parse_currency
+from src.utils.pagination import DEFAULT_PAGE_SIZE, encode_cursor, decode_cursor
 
+EXPORT_CHUNK_SIZE = 1000
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000  # errors reported back to the client, the rest are only counted
 
-async def create_ticket(user_id: int, amount: float, attachment_link: str = ''):
-    async for db in get_db():
+# columns of the ticket list and search, rows are plain tuples, no ORM entity is built
+TICKET_LIST_COLUMNS = (
+    Ticket.id, Ticket.amount, Ticket.currency, Ticket.merchant, Ticket.description, Ticket.attachment_link,
+    Ticket.purchase_time, Ticket.status, Ticket.created_time, User.email, User.username,
+)
+
+
+async def create_ticket(db: AsyncSession, user: User, amount: Decimal, attachment_link: str = '',
+                        currency: str = DEFAULT_CURRENCY, merchant: str | None = None, description: str | None = None):
+    new_ticket = Ticket(
+        purchase_time=datetime.now(),
+        purchaser_id=user.id,
+        amount=amount,
+        currency=currency,
+        merchant=merchant,
+        description=description,
+        attachment_link=attachment_link,
+        status=TicketStatus.PENDING.name,
+        created_time=datetime.now(),
+        updated_time=datetime.now(),
+    )
+    db.add(new_ticket)
+    await add_attachment_references(db, attachment_link)
+    await record_tickets_created(db, [(user.id, new_ticket.purchase_time, TicketStatus.PENDING, currency, amount)])
+    # committed with the request, flush assigns the id
+    await db.flush()
+    await db.refresh(new_ticket)
+    return new_ticket
+
+
+def _parse_ticket_row(row: dict, user: User) -> dict:
+    """
+    validate one ticket row from a batch request or an imported csv, raises ValueError with the reason
+    employers may set purchaser_email and status (legacy data migration), employees only create their own tickets
+    """
+    amount = parse_amount(row.get("amount"))
+    if not amount > 0:
+        raise ValueError("amount must be positive")
+    currency = parse_currency(row.get("currency"))
+
+    purchase_time = row.get("purchase_time") or None
+    if purchase_time is not None and not isinstance(purchase_time, datetime):
         try:
-            result = await db.execute(
-                select(User).where(and_(User.id == user_id, User.deleted == 0))
-            )
-            user = result.scalar_one_or_none()
-            new_ticket = Ticket(
-                purchase_time=datetime.now(),
-                purchaser_id=user.id,
-                amount=amount,
-                attachment_link=attachment_link,
-                status=TicketStatus.PENDING.name,
-                created_time=datetime.now(),
-                updated_time=datetime.now(),
-            )
-            db.add(new_ticket)
-            await db.commit()
-            await db.refresh(new_ticket)
-            return new_ticket
+            purchase_time = datetime.fromisoformat(str(purchase_time).strip())
+        except ValueError:
+            raise ValueError("purchase_time must be like YYYY-MM-DD HH:MM")
+    if purchase_time is not None:
+        # mixing aware and naive values would break the summary month keys
+        purchase_time = to_naive_local(purchase_time)
 
-        except Exception as e:
-            await db.rollback()
-            raise e
+    status = TicketStatus.PENDING
+    if row.get("status"):
+        status = TicketStatus.get_name(str(row.get("status")).strip())
+        if status is None:
+            raise ValueError("unknown status")
+        if status != TicketStatus.PENDING and user.group != UserGroup.EMPLOYER:
+            raise ValueError("only employers can import reviewed tickets")
+
+    purchaser_email = (row.get("purchaser_email") or "").strip() or None
+    if purchaser_email and purchaser_email != user.email and user.group != UserGroup.EMPLOYER:
+        raise ValueError("employees can only create their own tickets")
+
+    return {
+        "purchaser_email": purchaser_email or user.email,
+        "amount": amount,
+        "currency": currency,
+        "merchant": (row.get("merchant") or "").strip() or None,
+        "description": (row.get("description") or "").strip() or None,
+        "attachment_link": (row.get("attachment_link") or "").strip(),
+        "purchase_time": purchase_time,
+        "status": status,
+    }
+
+
+async def _insert_ticket_rows(db, rows: list[dict], purchaser_ids: dict[str, int]) -> list[int | str]:
+    """
+    insert parsed rows with multi-row INSERT ... RETURNING, returns the new id or the error of each row
+    purchaser_ids caches email -> user id across chunks, unknown emails are resolved with one query
+    """
+    unknown_emails = {row["purchaser_email"] for row in rows} - purchaser_ids.keys()
+    if unknown_emails:
+        result = await db.execute(
+            select(User.email, User.id).where(User.email.in_(unknown_emails), User.deleted == 0)
+        )
+        purchaser_ids.update(dict(result.all()))
+
+    now = datetime.now()
+    outcomes: list[int | str] = []
+    values = []
+    for row in rows:
+        purchaser_id = purchaser_ids.get(row["purchaser_email"])
+        if purchaser_id is None:
+            outcomes.append("purchaser not found")
+            continue
+        outcomes.append(len(values))
+        values.append({
+            "purchaser_id": purchaser_id,
+            "amount": row["amount"],
+            "currency": row["currency"],
+            "merchant": row["merchant"],
+            "description": row["description"],
+            "attachment_link": row["attachment_link"],
+            "purchase_time": row["purchase_time"] or now,
+            "status": row["status"],
+            "created_time": now,
+            "updated_time": now,
+            "deleted": 0,
+        })
+
+    ids = []
+    if values:
+        # executemany with RETURNING is sent as batched multi-row INSERTs (insertmanyvalues), ids in row order
+        result = await db.execute(
+            insert(Ticket).returning(Ticket.id, sort_by_parameter_order=True), values
+        )
+        ids = result.scalars().all()
+        await add_attachment_references(db, *(value["attachment_link"] for value in values))
+        await record_tickets_created(db, ((value["purchaser_id"], value["purchase_time"], value["status"],
+                                           value["currency"], value["amount"]) for value in values))
 
+    return [ids[outcome] if isinstance(outcome, int) else outcome for outcome in outcomes]
 
-async def list_tickets_for_user(email: str):
-    async for db in get_db():
+
+async def create_tickets(db: AsyncSession, user: User, rows: list[dict]) -> list[dict]:
+    """
+    create many tickets in the request's transaction,
+    returns [{"row": index, "ticket_id": id}] or [{"row": index, "error": reason}]
+    """
+    results = []
+    parsed = []
+    for index, row in enumerate(rows):
         try:
-            result = await db.execute(
-                select(User).where(and_(User.email == email, User.deleted == 0))
-            )
-            user = result.scalar_one_or_none()
-            group = user.group
-
-            tickets_with_user_info = []
-
-            # return different ticket lists based on user group
-            if group == UserGroup.EMPLOYEE.name:
-                result = await db.execute(
-                    select(Ticket, User.email, User.username).
-                    join(User, Ticket.purchaser_id == User.id).
-                    where(User.id == user.id)
-                )
-            else:
-                result = await db.execute(
-                    select(Ticket, User.email, User.username).
-                    outerjoin(User, Ticket.purchaser_id == User.id)
-                )
-            rows = result.all()
-            for row in rows:
-                ticket, email, username = row
-
-                tickets_with_user_info.append({
-                    'ticket': ticket,
-                    'user_info': {
-                        'email': email,
-                        'username': username
-                    },
-                })
-            return tickets_with_user_info
-        except Exception as e:
-            raise e
+            parsed.append((index, _parse_ticket_row(row, user)))
+        except ValueError as e:
+            results.append({"row": index, "error": str(e)})
+
+    outcomes = await _insert_ticket_rows(db, [row for _, row in parsed], {user.email: user.id})
+
+    for (index, _), outcome in zip(parsed, outcomes):
+        results.append({"row": index, "ticket_id": outcome} if isinstance(outcome, int)
+                       else {"row": index, "error": outcome})
+    return sorted(results, key=lambda item: item["row"])
+
 
+async def import_tickets(db: AsyncSession, user: User, records, chunk_size: int = IMPORT_CHUNK_SIZE,
+                         max_errors: int = IMPORT_MAX_ERRORS) -> dict:
+    """
+    import tickets from an async iterator of dict records (e.g. csv rows), validated one by one and inserted
+    in chunks, each chunk is committed on its own so a large import never holds one huge transaction,
+    the only service committing the request's session itself
+    """
+    imported = 0
+    failed = 0
+    errors = []
+    purchaser_ids = {user.email: user.id}
 
-async def approve_or_reject_ticket(ticket_id: int, new_status: str, user_id: int):
-    async for db in get_db():
+    def add_error(row_number: int, reason: str):
+        nonlocal failed
+        failed += 1
+        if len(errors) < max_errors:
+            errors.append({"row": row_number, "error": reason})
+
+    async def flush(chunk: list[tuple[int, dict]]):
+        nonlocal imported
         try:
-            result = await db.execute(
-                select(User).where(and_(User.id == user_id, User.deleted == 0))
-            )
-            user = result.scalar_one_or_none()
-            if user.group != UserGroup.EMPLOYER:
-                raise PermissionError("Not enough permissions")
-
-            ticket_result = await db.execute(
-                select(Ticket).where(Ticket.id == ticket_id)
-            )
-            ticket = ticket_result.scalar_one_or_none()
-            if not ticket:
-                raise ValueError("Ticket not found")
-
-            ticket.status = TicketStatus.get_name(new_status)
-            ticket.updated_time = datetime.now()
+            outcomes = await _insert_ticket_rows(db, [row for _, row in chunk], purchaser_ids)
             await db.commit()
-            await db.refresh(ticket)
-            return ticket
-
         except Exception as e:
+            await db.rollback()
             raise e
+        for (row_number, _), outcome in zip(chunk, outcomes):
+            if isinstance(outcome, int):
+                imported += 1
+            else:
+                add_error(row_number, outcome)
+
+    chunk = []
+    row_number = 0
+    async for record in records:
+        row_number += 1
+        try:
+            chunk.append((row_number, _parse_ticket_row(record, user)))
+        except ValueError as e:
+            add_error(row_number, str(e))
+        if len(chunk) >= chunk_size:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+
+def _visible_tickets_query(query, user: User):
+    # return different ticket lists based on user group
+    if user.group == UserGroup.EMPLOYEE:
+        return query.join(User, Ticket.purchaser_id == User.id).where(User.id == user.id)
+    return query.outerjoin(User, Ticket.purchaser_id == User.id)
+
+
+def _filter_tickets(query,
+                    status: TicketStatus | None = None,
+                    purchaser_id: int | None = None,
+                    min_amount: Decimal | None = None,
+                    max_amount: Decimal | None = None,
+                    created_from: datetime | None = None,
+                    created_to: datetime | None = None):
+    if status is not None:
+        query = query.where(Ticket.status == status)
+    if purchaser_id is not None:
+        query = query.where(Ticket.purchaser_id == purchaser_id)
+    if min_amount is not None:
+        query = query.where(Ticket.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(Ticket.amount <= max_amount)
+    if created_from is not None:
+        query = query.where(Ticket.created_time >= created_from)
+    if created_to is not None:
+        query = query.where(Ticket.created_time < created_to)
+    return query
+
+
+async def list_tickets_for_user(db: AsyncSession,
+                                user: User,
+                                limit: int = DEFAULT_PAGE_SIZE,
+                                cursor: str | None = None,
+                                status: TicketStatus | None = None,
+                                purchaser_id: int | None = None,
+                                min_amount: Decimal | None = None,
+                                max_amount: Decimal | None = None,
+                                created_from: datetime | None = None,
+                                created_to: datetime | None = None,
+                                descending: bool = True):
+    """
+    keyset pagination on (created_time, id), returns (rows, next_cursor), rows have TICKET_LIST_COLUMNS
+    next_cursor is None when there is no more page
+    """
+    query = _visible_tickets_query(select(*TICKET_LIST_COLUMNS), user)
+    query = _filter_tickets(query, status, purchaser_id, min_amount, max_amount, created_from, created_to)
+
+    sort_key = tuple_(Ticket.created_time, Ticket.id)
+    if cursor:
+        cursor_key = tuple_(*decode_cursor(cursor))
+        query = query.where(sort_key < cursor_key if descending else sort_key > cursor_key)
+
+    if descending:
+        query = query.order_by(Ticket.created_time.desc(), Ticket.id.desc())
+    else:
+        query = query.order_by(Ticket.created_time.asc(), Ticket.id.asc())
+
+    # fetch one more row to know whether there is a next page
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_time, rows[-1].id)
+    return rows, next_cursor
+
+
+async def search_tickets(db: AsyncSession, user: User, keyword: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+    """
+    ranked search over merchant / description (full text and trigram), purchaser username / email (trigram)
+    and the exact amount, returns (rows, next_offset), rows have TICKET_LIST_COLUMNS followed by the rank
+    every condition is served by its own index and combined by postgres with a bitmap OR
+    """
+    keyword = keyword.strip()
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, keyword)
+    document = search_document(Ticket.merchant, Ticket.description)
+
+    # purchasers matching the keyword, trigram indexes on the user table
+    matching_users = select(User.id).where(or_(
+        User.username.icontains(keyword, autoescape=True),
+        User.email.icontains(keyword, autoescape=True),
+        User.username.op("%")(keyword),
+    ))
+    conditions = [
+        document.op("@@")(ts_query),
+        Ticket.merchant.icontains(keyword, autoescape=True),
+        Ticket.purchaser_id.in_(matching_users),
+    ]
+    try:
+        conditions.append(Ticket.amount == parse_amount(keyword))
+    except ValueError:
+        pass
+
+    rank = (func.ts_rank(document, ts_query) +
+            func.greatest(func.similarity(func.coalesce(Ticket.merchant, ""), keyword),
+                          func.similarity(User.username, keyword),
+                          func.similarity(User.email, keyword))).label("rank")
+
+    query = _visible_tickets_query(select(*TICKET_LIST_COLUMNS, rank), user)
+    query = query.where(or_(*conditions)).order_by(rank.desc(), Ticket.id.desc())
+
+    # fetch one more row to know whether there is a next page
+    result = await db.execute(query.offset(offset).limit(limit + 1))
+    rows = result.all()
+    next_offset = offset + limit if len(rows) > limit else None
+    return rows[:limit], next_offset
+
+
+async def stream_tickets_for_user(user: User,
+                                  status: TicketStatus | None = None,
+                                  purchaser_id: int | None = None,
+                                  min_amount: Decimal | None = None,
+                                  max_amount: Decimal | None = None,
+                                  created_from: datetime | None = None,
+                                  created_to: datetime | None = None,
+                                  chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    stream ticket rows with a server side cursor, yields lists of at most chunk_size rows
+    uses its own session, the request's session has released its connection before the body is streamed
+    each row is (id, amount, currency, attachment_link, purchase_time, status, created_time, email, username)
+    """
+    async for db in get_read_db():
+        query = _visible_tickets_query(
+            select(Ticket.id, Ticket.amount, Ticket.currency, Ticket.attachment_link, Ticket.purchase_time,
+                   Ticket.status, Ticket.created_time, User.email, User.username),
+            user
+        )
+        query = _filter_tickets(query, status, purchaser_id, min_amount, max_amount, created_from, created_to)
+        query = query.order_by(Ticket.created_time.asc(), Ticket.id.asc())
+
+        result = await db.stream(query.execution_options(yield_per=chunk_size))
+        async for rows in result.partitions():
+            yield rows
+
+
+async def approve_or_reject_ticket(db: AsyncSession, ticket_id: int, new_status: str, user: User):
+    if user.group != UserGroup.EMPLOYER:
+        raise PermissionError("Not enough permissions")
+
+    # the row lock makes concurrent transitions of the same ticket take turns, each sees the status left by the
+    # other one, so the summary deltas computed from old_status never count a ticket twice
+    ticket_result = await db.execute(
+        select(Ticket).where(Ticket.id == ticket_id).with_for_update()
+    )
+    ticket = ticket_result.scalar_one_or_none()
+    if not ticket:
+        raise ValueError("Ticket not found")
+
+    old_status = ticket.status
+    ticket.status = TicketStatus.get_name(new_status)
+    ticket.updated_time = datetime.now()
+    await record_status_changed(db, [(ticket.purchaser_id, ticket.purchase_time, ticket.currency,
+                                      ticket.amount, old_status, ticket.status)])
+    await db.flush()
+    return ticket
+
+
+async def bulk_approve_or_reject_tickets(db: AsyncSession, ticket_ids: list[int], new_status: TicketStatus,
+                                         user: User) -> dict:
+    """
+    move pending tickets to new_status with one set based UPDATE ... RETURNING in the request's transaction
+    returns {ticket_id: outcome}, outcome is "updated", "not_pending" or "not_found"
+    """
+    if user.group != UserGroup.EMPLOYER:
+        raise PermissionError("Not enough permissions")
+
+    ticket_ids = list(dict.fromkeys(ticket_ids))
+    ids_param = bindparam("ticket_ids", ticket_ids, type_=ARRAY(Integer))
+
+    result = await db.execute(
+        update(Ticket).
+        where(Ticket.id == any_(ids_param), Ticket.status == TicketStatus.PENDING).
+        values(status=new_status, updated_time=datetime.now()).
+        returning(Ticket.id, Ticket.purchaser_id, Ticket.purchase_time, Ticket.currency, Ticket.amount).
+        execution_options(synchronize_session=False)
+    )
+    updated = result.all()
+    updated_ids = {row.id for row in updated}
+    await record_status_changed(db, ((row.purchaser_id, row.purchase_time, row.currency, row.amount,
+                                      TicketStatus.PENDING, new_status) for row in updated))
+
+    outcomes = {ticket_id: "updated" for ticket_id in updated_ids}
+    skipped_ids = [ticket_id for ticket_id in ticket_ids if ticket_id not in updated_ids]
+    if skipped_ids:
+        # only the skipped tickets are looked up, to tell not pending from not found
+        result = await db.execute(
+            select(Ticket.id).where(Ticket.id == any_(bindparam("skipped_ids", skipped_ids,
+                                                                  type_=ARRAY(Integer))))
+        )
+        existing_ids = set(result.scalars().all())
+        for ticket_id in skipped_ids:
+            outcomes[ticket_id] = "not_pending" if ticket_id in existing_ids else "not_found"
+
+    return outcomes
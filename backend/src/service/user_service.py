@@ -1,98 +1,236 @@
+import time
 from datetime import datetime
 
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, or_, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.db.db_configs import get_db
+from src.db.db_configs import after_commit, mark_writer
 from src.db.db_enum import UserGroup
 from src.db.modals.user import User
-from src.utils.auth import sha256_encrypt, decode_auth_token
-
-
-async def login(email: str, password: str) -> User | None:
-    async for db in get_db():
-        result = await db.execute(
-            select(User).where(User.email == email, User.password == sha256_encrypt(password))
-        )
-        user = result.scalar_one_or_none()
-        return user
-
-
-async def is_email_existing(email: str) -> bool:
-    async for db in get_db():
-        result = await db.execute(
-            select(User).where(User.email == email)
-        )
-        user = result.scalar_one_or_none()
-        return user is not None
+from src.config import cache_conf
+from src.utils.auth import TOKEN_EXPIRE_HOURS
+from src.utils.cache import TTLCache
+from src.utils.metrics import register_cache
+from src.utils.pagination import DEFAULT_PAGE_SIZE, encode_key_cursor, decode_key_cursor
+from src.utils.password import hash_password, verify_password
+from src.utils.session_store import session_store
+
+# user id -> (username, email, group, deleted), only active users are cached
+user_cache = TTLCache(
+    max_size=cache_conf().get("user_cache_size", 10000),
+    ttl=cache_conf().get("user_cache_ttl_seconds", 60),
+)
+# columns of the employee list and search, rows are plain tuples, no ORM entity is built
+USER_LIST_COLUMNS = (User.id, User.username, User.email, User.group, User.deleted, User.created_time)
+# employee list filters -> (count, estimated)
+user_count_cache = TTLCache(max_size=256, ttl=cache_conf().get("user_count_ttl_seconds", 30))
+# below this many rows the user table is counted exactly
+USER_COUNT_ESTIMATE_THRESHOLD = cache_conf().get("user_count_estimate_threshold", 100000)
+register_cache("user", user_cache)
+register_cache("user_count", user_count_cache)
+
+
+async def login(db: AsyncSession, email: str, password: str) -> User | None:
+    result = await db.execute(
+        select(User).where(User.email == email)
+    )
+    user = result.scalar_one_or_none()
+    if not user:
+        return None
+
+    is_valid, new_hash = await verify_password(password, user.password)
+    if not is_valid:
+        return None
+
+    # transparently upgrade legacy sha256 or weaker hashes, saved by the request's commit
+    if new_hash:
+        user.password = new_hash
+        user.updated_time = datetime.now()
+    # the request has no token yet, so keep the reads of the user who just logged in on the primary by id
+    mark_writer(db, user.id)
+    return user
+
+
+async def logout(token_payload: dict):
+    jti = token_payload.get("jti")
+    if not jti:
+        return
+    ttl = int(token_payload.get("exp", time.time()) - time.time())
+    if ttl > 0:
+        await session_store.revoke_token(jti, ttl)
+
+
+async def is_email_existing(db: AsyncSession, email: str) -> bool:
+    result = await db.execute(
+        select(User).where(User.email == email)
+    )
+    user = result.scalar_one_or_none()
+    return user is not None
 
 
-async def get_user_by_id (id: int) -> User | None:
-    async for db in get_db():
-        query = select(User).where(and_(User.id == id, User.deleted == 0))
-        result = await db.execute(query)
-        return result.scalar_one_or_none()
+async def get_user_by_id(db: AsyncSession, id: int) -> User | None:
+    """
+    query active user by id, cached in process by user_cache
+    the returned user is transient and only carries id, username, email, group and deleted
+    """
+    cached = await user_cache.get_or_load(id, lambda: _load_cached_user(db, id))
+    if cached is None:
+        return None
+    username, email, group, deleted = cached
+    return User(id=id, username=username, email=email, group=group, deleted=deleted)
 
 
-async def get_user_id_from_token(token):
-    if token.startswith("Bearer "):
-        token = token[7:]
-    token_obj = decode_auth_token(token)
-    user_id = token_obj.get("data").get("id") if token_obj and token_obj.get("data") else None
-    return user_id
+async def _load_cached_user(db: AsyncSession, id: int) -> tuple | None:
+    query = select(User.username, User.email, User.group, User.deleted).where(
+        and_(User.id == id, User.deleted == 0)
+    )
+    result = await db.execute(query)
+    row = result.one_or_none()
+    return tuple(row) if row else None
 
 
-async def register(username: str, email: str, password: str, group: str) -> User:
+async def register(db: AsyncSession, username: str, email: str, password: str, group: str) -> User:
     new_user = User(
         username=username,
         email=email,
-        password=sha256_encrypt(password),
+        password=await hash_password(password),
         group=UserGroup.get_name(group),
         created_time=datetime.now(),
         updated_time=datetime.now(),
     )
 
-    try:
-        async for db in get_db():
-            db.add(new_user)
-            await db.commit()
-            await db.refresh(new_user)
-            return new_user
-    except Exception as e:
-        raise e
+    db.add(new_user)
+    await db.flush()
+    await db.refresh(new_user)
+    after_commit(db, lambda: user_cache.invalidate(new_user.id))
+    after_commit(db, user_count_cache.clear)
+    mark_writer(db, new_user.id)
+    return new_user
+
+
+def _filter_users(query,
+                  group: UserGroup | None = None,
+                  suspended: bool | None = None,
+                  created_from: datetime | None = None,
+                  created_to: datetime | None = None):
+    if group is not None:
+        query = query.where(User.group == group)
+    if suspended is not None:
+        query = query.where(User.deleted == int(suspended))
+    if created_from is not None:
+        query = query.where(User.created_time >= created_from)
+    if created_to is not None:
+        query = query.where(User.created_time < created_to)
+    return query
+
+
+async def list_users(db: AsyncSession,
+                     user: User,
+                     limit: int = DEFAULT_PAGE_SIZE,
+                     cursor: str | None = None,
+                     group: UserGroup | None = None,
+                     suspended: bool | None = None,
+                     created_from: datetime | None = None,
+                     created_to: datetime | None = None) -> tuple[list, str | None]:
+    """
+    keyset pagination ordered by (deleted asc, id desc), active users first, returns (rows, next_cursor)
+    rows have USER_LIST_COLUMNS, the password hash is never loaded
+    """
+    if user.group != UserGroup.EMPLOYER:
+        raise PermissionError("Not enough permissions")
+
+    query = _filter_users(select(*USER_LIST_COLUMNS), group, suspended, created_from, created_to)
+    if cursor:
+        # a tampered cursor may carry strings, lists or objects, only integers reach the query
+        try:
+            deleted, last_id = (int(value) for value in decode_key_cursor(cursor, 2))
+        except TypeError as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+        # same order as the index, the directions differ so it can't be one row comparison
+        query = query.where(or_(User.deleted > deleted, and_(User.deleted == deleted, User.id < last_id)))
+
+    result = await db.execute(
+        query.order_by(User.deleted.asc(), User.id.desc()).limit(limit + 1)
+    )
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_key_cursor(rows[-1].deleted, rows[-1].id)
+    return rows, next_cursor
+
+
+async def count_users(db: AsyncSession,
+                      user: User,
+                      group: UserGroup | None = None,
+                      suspended: bool | None = None,
+                      created_from: datetime | None = None,
+                      created_to: datetime | None = None) -> tuple[int, bool]:
+    """
+    total for the employee list, returns (count, estimated)
+    without filters a large table is estimated from the planner statistics instead of counted,
+    filtered counts are exact and cached for a short time
+    """
+    if user.group != UserGroup.EMPLOYER:
+        raise PermissionError("Not enough permissions")
+
+    key = (group, suspended, created_from, created_to)
+    return await user_count_cache.get_or_load(key, lambda: _count_users(db, *key))
+
+
+async def _count_users(db: AsyncSession, group, suspended, created_from, created_to) -> tuple[int, bool]:
+    if group is None and suspended is None and created_from is None and created_to is None:
+        # reltuples is -1 before the table is first analyzed
+        result = await db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table_name)"),
+            {"table_name": f'"{User.__tablename__}"'}
+        )
+        estimate = result.scalar_one_or_none()
+        if estimate is not None and estimate >= USER_COUNT_ESTIMATE_THRESHOLD:
+            return estimate, True
+
+    result = await db.execute(
+        _filter_users(select(func.count()).select_from(User), group, suspended, created_from, created_to)
+    )
+    return result.scalar_one(), False
+
+
+async def search_users(db: AsyncSession, user: User, keyword: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+    """
+    search users by partial or misspelled username / email, ranked by trigram similarity
+    returns (rows, next_offset), rows have USER_LIST_COLUMNS followed by the rank
+    """
+    if user.group != UserGroup.EMPLOYER:
+        raise PermissionError("Not enough permissions")
+
+    keyword = keyword.strip()
+    rank = func.greatest(func.similarity(User.username, keyword), func.similarity(User.email, keyword)).label("rank")
+    result = await db.execute(
+        select(*USER_LIST_COLUMNS, rank).where(or_(
+            User.username.icontains(keyword, autoescape=True),
+            User.email.icontains(keyword, autoescape=True),
+            User.username.op("%")(keyword),
+            User.email.op("%")(keyword),
+        )).order_by(rank.desc(), User.id.desc()).offset(offset).limit(limit + 1)
+    )
+    rows = result.all()
+    next_offset = offset + limit if len(rows) > limit else None
+    return rows[:limit], next_offset
 
 
-async def list_users(user_id: int) -> list[User]:
-    async for db in get_db():
-        try:
-            result = await db.execute(
-                select(User).where(and_(User.id == user_id, User.deleted == 0))
-            )
-            user = result.scalar_one_or_none()
-            if user.group != UserGroup.EMPLOYER:
-                raise PermissionError("Not enough permissions")
-
-            result = await db.execute(
-                select(User).order_by(User.deleted.asc(), User.id.desc())
-            )
-            users = result.scalars().all()
-            return users
-        except Exception as e:
-            raise e
-
-
-async def suspend_user(suspend_user_id: int, deleted: bool) -> User:
-    async for db in get_db():
-        try:
-            result = await db.execute(
-                select(User).where(and_(User.id == suspend_user_id))
-            )
-            user = result.scalar_one_or_none()
-            if not user:
-                raise ValueError("User not exist")
-            user.deleted = deleted
-            user.updated_time = datetime.now()
-            await db.commit()
-            await db.refresh(user)
-            return user
-        except Exception as e:
-            raise e
+async def suspend_user(db: AsyncSession, suspend_user_id: int, deleted: bool) -> User:
+    result = await db.execute(
+        select(User).where(and_(User.id == suspend_user_id))
+    )
+    user = result.scalar_one_or_none()
+    if not user:
+        raise ValueError("User not exist")
+    user.deleted = deleted
+    user.updated_time = datetime.now()
+    await db.flush()
+    after_commit(db, lambda: user_cache.invalidate(user.id))
+    after_commit(db, user_count_cache.clear)
+    if user.deleted:
+        # other workers may still cache the user, revoke its tokens in the shared store
+        await session_store.revoke_user(user.id, TOKEN_EXPIRE_HOURS * 3600)
+    return user
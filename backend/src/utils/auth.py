@@ -1,25 +1,21 @@
-import hashlib
 import datetime
+import uuid
+
 import jwt
 
 from src.config import auth_conf
-from src.db.modals.user import User
-from src.service import user_service
 
 # auth constants
 SECRET_KEY = auth_conf().get("auth_secret_key")
 ALGORITHM = 'HS256'
+TOKEN_EXPIRE_HOURS = 24
 
 
-# encrypt password using sha256
-def sha256_encrypt(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-
-# token encode and decode, todo add redis as token cache to validate expire time
-def encode_auth_token(user_id, password, login_time, expire=24):
+# token encode and decode, revocation is checked against session_store
+def encode_auth_token(user_id, password, login_time, expire=TOKEN_EXPIRE_HOURS):
     payload = {
         'iss': 'ken',  # 签名
+        'jti': uuid.uuid4().hex,  # token id, 用于撤销
         'exp': datetime.datetime.utcnow() + datetime.timedelta(days=0, hours=expire),  # 过期时间
         'iat': datetime.datetime.utcnow(),  # 开始时间
         'data': {
@@ -37,22 +33,8 @@ def encode_auth_token(user_id, password, login_time, expire=24):
 
 
 def decode_auth_token(auth_token):
-    payload = jwt.decode(auth_token, SECRET_KEY, algorithms=ALGORITHM, options={'verify_exp': False})
+    payload = jwt.decode(auth_token, SECRET_KEY, algorithms=ALGORITHM)
     if 'data' in payload and 'id' in payload['data'] and 'password' in payload['data']:
         return payload
     else:
         raise jwt.InvalidTokenError
-
-
-def validate_token(token):
-    try:
-        payload = decode_auth_token(token)
-        user_id = payload['data']['id']
-        password = payload['data']['password']
-        user = user_service.login(user_id, password)
-        if isinstance(user, User):
-            return payload
-        else:
-            return False
-    except Exception as e:
-        raise e
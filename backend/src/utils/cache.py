@@ -0,0 +1,86 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+# result of a load whose task was cancelled, its waiters load the value again themselves
+_RELOAD = object()
+
+
+class TTLCache:
+    """
+    进程内 LRU + TTL 缓存，同一个 key 并发未命中时只调用一次 loader
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._loading: dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> Any | None:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self._loading.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any | None:
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            pending = self._loading.get(key)
+            if pending is None:
+                break
+            value = await asyncio.shield(pending)
+            if value is not _RELOAD:
+                return value
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+            if isinstance(e, asyncio.CancelledError):
+                # only the loading request was cancelled, e.g. its client disconnected, not the waiting ones
+                future.set_result(_RELOAD)
+            else:
+                future.set_exception(e)
+                # mark as retrieved, waiters get the exception from their own await
+                future.exception()
+            raise
+
+        # a load started before an invalidation must not write its stale result back
+        if self._loading.get(key) is future:
+            del self._loading[key]
+            if value is not None:
+                self.set(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
@@ -1,3 +1,6 @@
+import asyncio
+import codecs
+import csv
 import os
 import uuid
 from datetime import datetime
@@ -19,6 +22,71 @@ def generate_unique_filename(original_filename: str) -> str:
     return f"{timestamp}_{unique_id}{ext}"
 
 
+def content_addressed_path(digest: str, ext: str) -> str:
+    """按内容哈希生成两级分片的相对路径，如 ab/cd/abcd...ef.pdf"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
 def is_allowed_file(filename: str) -> bool:
     """检查文件类型是否允许"""
     return get_file_extension(filename) in ALLOWED_EXTENSIONS
+
+
+def _decoded_lines(raw, chunk_size: int):
+    """utf-8 lines of a binary file with their line endings, read chunk by chunk"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    while True:
+        chunk = raw.read(chunk_size)
+        lines = (tail + decoder.decode(chunk, final=not chunk)).split("\n")
+        # the last piece may be an incomplete line until the file is finished
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+        if not chunk:
+            if tail:
+                yield tail
+            return
+
+
+def _read_rows(reader, count: int) -> tuple[list, Exception | None]:
+    """up to count rows, the rows read before an invalid one are returned with the error"""
+    rows = []
+    try:
+        for values in reader:
+            rows.append(values)
+            if len(rows) >= count:
+                break
+    except (csv.Error, UnicodeDecodeError) as e:
+        return rows, e
+    return rows, None
+
+
+async def iter_csv_records(file, chunk_size: int = 64 * 1024, batch_size: int = 1000):
+    """
+    逐块读取上传的 CSV 文件，按表头逐行产出 dict，内存占用与文件大小无关
+    file 是 UploadFile，一个 csv.reader 流式解析整个文件（引号内的换行由 csv 处理），读取和解析在线程中执行
+    格式错误时抛出 csv.Error，错误信息包含出错的行号（不含表头和空行，与导入结果的 row 一致）
+    """
+    # strict: a quote left open at the end of the file is an error instead of swallowing the following rows
+    reader = csv.reader(_decoded_lines(file.file, chunk_size), strict=True)
+    header = None
+    row_number = 0
+
+    while True:
+        rows, error = await asyncio.to_thread(_read_rows, reader, batch_size)
+        for values in rows:
+            if not any(value.strip() for value in values):
+                continue
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            row_number += 1
+            yield dict(zip(header, values))
+
+        if isinstance(error, csv.Error):
+            raise csv.Error(f"row {row_number + 1}: {error}") from error
+        if error is not None:
+            raise error
+        if not rows:
+            return
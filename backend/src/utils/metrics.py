@@ -0,0 +1,212 @@
+"""
+进程内指标，按 Prometheus 文本格式输出，每个 worker 进程各自统计，由 Prometheus 按实例汇总
+指标只在事件循环线程中更新，不加锁
+"""
+import bisect
+import math
+from contextvars import ContextVar
+from typing import Callable
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+UPLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# queries per request, a route that climbs with the page size is an N+1
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    monotonic counter, or read from collect() at scrape time, collect returns {label values: value}
+    """
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), collect: Callable[[], dict] | None = None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        return self.collect() if self.collect is not None else self._values
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in self.values().items()]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value: float):
+        self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (last one is +Inf), sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        item = self._values.get(label_values)
+        if item is None:
+            item = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def _samples(self) -> list[str]:
+        lines = []
+        le_labels = self.labels + ("le",)
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(le_labels, key + (_format_value(float(bound)),))} "
+                             f"{cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class RequestStats:
+    """database work of the current request, filled in by the engine event hooks and the pool"""
+    __slots__ = ("queries", "query_seconds", "checkouts")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.checkouts = 0
+
+
+# set by the metrics middleware, None outside a request (startup, background tasks started before a request)
+current_request_stats: ContextVar[RequestStats | None] = ContextVar("current_request_stats", default=None)
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Time from receiving the request to the end of the response body.",
+    ("method", "route", "status"), LATENCY_BUCKETS,
+))
+HTTP_REQUESTS_IN_PROGRESS = registry.register(Gauge(
+    "http_requests_in_progress", "Requests being handled by this process.",
+))
+REQUEST_DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "Database queries executed per request.", ("method", "route"), QUERY_COUNT_BUCKETS,
+))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in database queries per request.", ("method", "route"), LATENCY_BUCKETS,
+))
+# one per request with the request scoped session, more means a service opened a session of its own
+REQUEST_DB_CHECKOUTS = registry.register(Histogram(
+    "http_request_db_checkouts", "Connections checked out of the pools per request.", ("method", "route"),
+    QUERY_COUNT_BUCKETS,
+))
+DB_QUERY_SECONDS = registry.register(Histogram(
+    "db_query_duration_seconds", "Database query execution time by statement type.", ("statement",), QUERY_BUCKETS,
+))
+DB_QUERY_ERRORS = registry.register(Counter(
+    "db_query_errors_total", "Database queries that raised an error.", ("statement",),
+))
+DB_POOL_CHECKOUT_SECONDS = registry.register(Histogram(
+    "db_pool_checkout_seconds", "Time waiting for a connection from the pool, including opening new connections.",
+    ("pool",), POOL_WAIT_BUCKETS,
+))
+DB_POOL_TIMEOUTS = registry.register(Counter(
+    "db_pool_timeouts_total", "Checkouts that gave up after pool_timeout because the pool was exhausted.", ("pool",),
+))
+UPLOAD_FILES = registry.register(Counter(
+    "upload_files_total", "Uploaded attachment files by result.", ("result",),
+))
+UPLOAD_BYTES = registry.register(Counter(
+    "upload_bytes_total", "Bytes received in attachment uploads by result.", ("result",),
+))
+UPLOAD_SECONDS = registry.register(Histogram(
+    "upload_duration_seconds", "Time to receive, hash and store one attachment file by result.",
+    ("result",), UPLOAD_BUCKETS,
+))
+
+# name -> TTLCache, read at scrape time
+_caches: dict = {}
+
+
+def register_cache(name: str, cache):
+    """expose hits / misses / size of a TTLCache"""
+    _caches[name] = cache
+
+
+def _cache_stat(stat: str) -> dict:
+    return {(name,): cache.stats()[stat] for name, cache in _caches.items()}
+
+
+registry.register(Counter("cache_hits_total", "In process cache hits.", ("cache",),
+                          collect=lambda: _cache_stat("hits")))
+registry.register(Counter("cache_misses_total", "In process cache misses.", ("cache",),
+                          collect=lambda: _cache_stat("misses")))
+registry.register(Gauge("cache_entries", "Entries held by the in process cache.", ("cache",),
+                        collect=lambda: _cache_stat("size")))
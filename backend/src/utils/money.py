@@ -0,0 +1,57 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from src.config import project_conf
+
+DEFAULT_CURRENCY = project_conf().get("default_currency", "CNY")
+AMOUNT_PRECISION = 12  # digits of Ticket.amount, 10 before and 2 after the decimal point
+AMOUNT_SCALE = 2
+MINOR_UNITS = 10 ** AMOUNT_SCALE  # minor units (fen / cents) per unit
+CENT = Decimal(1).scaleb(-AMOUNT_SCALE)
+MAX_AMOUNT = Decimal(10) ** (AMOUNT_PRECISION - AMOUNT_SCALE) - CENT
+
+_CURRENCY_PATTERN = re.compile(r"^[A-Z]{3}$")
+
+
+def parse_amount(value) -> Decimal:
+    """
+    金额统一转换为 Decimal，浮点数按其十进制字面值解析（0.1 -> 0.10），超过两位小数时报错，不做舍入
+    """
+    if isinstance(value, bool):
+        raise ValueError("amount must be a number")
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError("amount must be a number")
+    if not amount.is_finite():
+        raise ValueError("amount must be a number")
+    if amount != amount.quantize(CENT):
+        raise ValueError(f"amount can have at most {AMOUNT_SCALE} decimal places")
+    if abs(amount) > MAX_AMOUNT:
+        raise ValueError("amount is too large")
+    return amount.quantize(CENT)
+
+
+def parse_currency(value: str | None) -> str:
+    if not value:
+        return DEFAULT_CURRENCY
+    currency = str(value).strip().upper()
+    if not _CURRENCY_PATTERN.match(currency):
+        raise ValueError("currency must be a 3 letter ISO 4217 code")
+    return currency
+
+
+def to_minor_units(amount: Decimal) -> int:
+    return int(amount.scaleb(AMOUNT_SCALE))
+
+
+def from_minor_units(minor_units: int) -> Decimal:
+    return Decimal(minor_units).scaleb(-AMOUNT_SCALE).quantize(CENT)
+
+
+def amount_to_json(amount: Decimal | None) -> float | None:
+    """
+    返回给前端的金额仍为 JSON number，两位小数的 Decimal 转成 float 后显示不会有误差，
+    计算一律在数据库或 Decimal / 整数分上完成
+    """
+    return None if amount is None else float(amount)
@@ -0,0 +1,42 @@
+import base64
+import json
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# ranked search results are paged by offset, deep pages are refused instead of scanning every match
+MAX_SEARCH_OFFSET = 1000
+
+
+def encode_cursor(created_time: datetime, row_id: int) -> str:
+    """将 (created_time, id) 编码为不透明的游标字符串"""
+    raw = json.dumps({"t": created_time.isoformat(), "id": row_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """解析游标字符串，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return datetime.fromisoformat(data["t"]), int(data["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def encode_key_cursor(*values) -> str:
+    """将任意可 JSON 序列化的排序键编码为游标字符串"""
+    raw = json.dumps(list(values))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_key_cursor(cursor: str, size: int) -> list:
+    """解析 encode_key_cursor 生成的游标，键的个数不符时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
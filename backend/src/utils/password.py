@@ -0,0 +1,36 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from src.config import auth_conf
+
+# scrypt cost, N = 2 ** rounds, hashes below min_rounds are upgraded on next login
+PASSWORD_HASH_ROUNDS = auth_conf().get("password_hash_rounds", 14)
+PASSWORD_HASH_WORKERS = auth_conf().get("password_hash_workers", 2)
+
+# hex_sha256 is the legacy unsalted sha256 hex digest, only kept to verify and rehash old passwords
+pwd_context = CryptContext(
+    schemes=["scrypt", "hex_sha256"],
+    deprecated=["hex_sha256"],
+    scrypt__default_rounds=PASSWORD_HASH_ROUNDS,
+    scrypt__min_rounds=PASSWORD_HASH_ROUNDS,
+)
+
+# hashing is cpu bound, run it on a bounded pool so it never blocks the event loop
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed: str | None) -> tuple[bool, str | None]:
+    """
+    returns (is_valid, new_hash), new_hash is not None when the stored hash should be replaced
+    """
+    if not hashed or pwd_context.identify(hashed, required=False) is None:
+        return False, None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, pwd_context.verify_and_update, password, hashed)
@@ -0,0 +1,38 @@
+import datetime
+import json
+from decimal import Decimal
+from enum import Enum
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, falls back to the json module
+    orjson = None
+
+
+def _default(value):
+    """types the encoders don't handle natively"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        # same as orjson, which encodes enums natively by their value
+        return value.value
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson when installed, compact utf-8 json otherwise
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,141 @@
+import math
+import time
+from abc import ABC, abstractmethod
+
+from src.config import session_store_conf
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # redis is optional, only needed by RedisSessionStore
+    redis = None
+
+
+class SessionStore(ABC):
+    """
+    token 撤销记录，jwt 本身校验签名和过期时间，这里只记录被撤销的 token 和用户
+    is_valid 只需要一次查询，多个 worker 共享同一个 store 时撤销立即生效
+    """
+
+    @abstractmethod
+    async def revoke_token(self, jti: str, ttl: int):
+        """revoke one token, ttl should cover the remaining lifetime of the token"""
+
+    @abstractmethod
+    async def revoke_user(self, user_id: int, ttl: int):
+        """revoke all tokens of the user issued until now"""
+
+    @abstractmethod
+    async def is_valid(self, jti: str | None, user_id: int, issued_at: int | None) -> bool:
+        """check token is neither revoked itself nor issued before its user was revoked"""
+
+    @abstractmethod
+    async def mark_writer(self, user_id: int, ttl: float):
+        """the user committed a write on the primary, its reads stay on the primary for ttl seconds"""
+
+    @abstractmethod
+    async def is_recent_writer(self, user_id: int) -> bool:
+        """check the user committed a write within the ttl of its last mark_writer"""
+
+
+class MemorySessionStore(SessionStore):
+    """
+    进程内实现，只适用于单 worker 部署，多 worker 时撤销只在当前 worker 生效
+    """
+
+    def __init__(self):
+        self._revoked_tokens: dict[str, float] = {}
+        self._revoked_users: dict[int, tuple[float, float]] = {}
+        self._writers: dict[int, float] = {}
+
+    async def revoke_token(self, jti: str, ttl: int):
+        self._revoked_tokens[jti] = time.time() + ttl
+
+    async def revoke_user(self, user_id: int, ttl: int):
+        now = time.time()
+        self._revoked_users[user_id] = (now, now + ttl)
+
+    async def is_valid(self, jti: str | None, user_id: int, issued_at: int | None) -> bool:
+        now = time.time()
+        token_expire_at = self._revoked_tokens.get(jti)
+        if token_expire_at is not None:
+            if token_expire_at > now:
+                return False
+            del self._revoked_tokens[jti]
+
+        user_revoked = self._revoked_users.get(user_id)
+        if user_revoked is not None:
+            revoked_at, expire_at = user_revoked
+            if expire_at <= now:
+                del self._revoked_users[user_id]
+            elif issued_at is None or issued_at <= revoked_at:
+                return False
+        return True
+
+    async def mark_writer(self, user_id: int, ttl: float):
+        self._writers[user_id] = time.time() + ttl
+
+    async def is_recent_writer(self, user_id: int) -> bool:
+        expire_at = self._writers.get(user_id)
+        if expire_at is None:
+            return False
+        if expire_at <= time.time():
+            del self._writers[user_id]
+            return False
+        return True
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis 协议实现，适用于多 worker / 多实例部署，client 可以注入兼容 redis.asyncio 的对象
+    """
+
+    def __init__(self, url: str = None, key_prefix: str = "reimbursement:", client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("redis package is required by RedisSessionStore, please install redis")
+            client = redis.from_url(url)
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def _token_key(self, jti: str) -> str:
+        return f"{self.key_prefix}revoked_token:{jti}"
+
+    def _user_key(self, user_id: int) -> str:
+        return f"{self.key_prefix}revoked_user:{user_id}"
+
+    def _writer_key(self, user_id: int) -> str:
+        return f"{self.key_prefix}recent_writer:{user_id}"
+
+    async def revoke_token(self, jti: str, ttl: int):
+        await self.client.set(self._token_key(jti), 1, ex=ttl)
+
+    async def revoke_user(self, user_id: int, ttl: int):
+        await self.client.set(self._user_key(user_id), time.time(), ex=ttl)
+
+    async def is_valid(self, jti: str | None, user_id: int, issued_at: int | None) -> bool:
+        # one round trip for both keys
+        revoked_token, revoked_at = await self.client.mget(self._token_key(jti or ""), self._user_key(user_id))
+        if revoked_token is not None:
+            return False
+        if revoked_at is not None and (issued_at is None or issued_at <= float(revoked_at)):
+            return False
+        return True
+
+    async def mark_writer(self, user_id: int, ttl: float):
+        await self.client.set(self._writer_key(user_id), 1, ex=max(1, math.ceil(ttl)))
+
+    async def is_recent_writer(self, user_id: int) -> bool:
+        return await self.client.exists(self._writer_key(user_id)) > 0
+
+
+def create_session_store(conf: dict) -> SessionStore:
+    backend = conf.get("backend", "memory")
+    if backend == "redis":
+        return RedisSessionStore(conf.get("redis_url", "redis://localhost:6379/0"),
+                                 conf.get("key_prefix", "reimbursement:"))
+    if backend == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"Unknown session store backend: {backend}")
+
+
+session_store = create_session_store(session_store_conf())
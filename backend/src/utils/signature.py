@@ -0,0 +1,26 @@
+import hashlib
+import hmac
+import time
+
+from src.config import auth_conf
+
+SECRET_KEY = auth_conf().get("auth_secret_key")
+
+
+def stable_expire_time(ttl: int) -> int:
+    """
+    expire time rounded to a window of ttl seconds, so a signed url stays the same within the window
+    and the browser cache keeps hitting; a url is valid for between ttl and 2 * ttl seconds
+    """
+    return (int(time.time()) // ttl + 2) * ttl
+
+
+def sign(value: str, expires: int) -> str:
+    message = f"{value}:{expires}".encode()
+    return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(value: str, expires: int | None, signature: str | None) -> bool:
+    if not expires or not signature or expires < time.time():
+        return False
+    return hmac.compare_digest(sign(value, expires), signature)
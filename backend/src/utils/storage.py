@@ -0,0 +1,195 @@
+import asyncio
+import os
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+
+from src.config import storage_conf, project_conf
+from src.utils.signature import sign, stable_expire_time
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:  # boto3 is optional, only needed by S3Storage
+    boto3 = None
+    TransferConfig = None
+
+
+class StorageBackend(ABC):
+    """
+    附件存储后端，数据库和 ticket.attachment_link 中保存的是 reference（url_prefix/key），
+    下载地址在返回给客户端时通过 download_url 生成
+    """
+
+    def __init__(self, url_prefix: str, tmp_dir: str):
+        self.url_prefix = url_prefix
+        # uploads are written here before they are moved into the store
+        self.tmp_dir = tmp_dir
+
+    def reference(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def key_of(self, reference: str) -> str:
+        return reference.removeprefix(f"{self.url_prefix}/")
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """check whether the key is already stored"""
+
+    @abstractmethod
+    async def save_file(self, local_path: str, key: str, content_type: str | None = None):
+        """move a finished local file into the store, local_path is consumed"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """delete the stored key, missing keys are ignored"""
+
+    @abstractmethod
+    def download_url(self, reference: str) -> str:
+        """url the client downloads the attachment from"""
+
+    @abstractmethod
+    def local_copy(self, key: str):
+        """async context manager yielding a local file path with the content of key"""
+
+
+class LocalStorage(StorageBackend):
+    """
+    本地磁盘存储，文件由附件下载接口提供，下载地址带有过期时间和签名
+    """
+
+    def __init__(self, root_dir: str, url_prefix: str = "static",
+                 download_prefix: str = "api/files/attachments", signed_url_ttl: int = 86400):
+        # temp files live under root_dir so moving them into the store is an atomic rename
+        super().__init__(url_prefix, os.path.join(root_dir, ".tmp"))
+        self.root_dir = root_dir
+        self.download_prefix = download_prefix
+        self.signed_url_ttl = signed_url_ttl
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_of(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def safe_path_of(self, key: str) -> str | None:
+        """path of a client supplied key, None when it escapes root_dir or points into the temp dir"""
+        root = os.path.realpath(self.root_dir)
+        path = os.path.realpath(os.path.join(root, key))
+        if not path.startswith(root + os.sep) or path.startswith(os.path.realpath(self.tmp_dir) + os.sep):
+            return None
+        return path
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self.path_of(key))
+
+    async def save_file(self, local_path: str, key: str, content_type: str | None = None):
+        await asyncio.to_thread(self._move, local_path, self.path_of(key))
+
+    @staticmethod
+    def _move(local_path: str, target_path: str):
+        if os.path.exists(target_path):
+            # duplicate content, keep the stored copy
+            os.remove(local_path)
+            return
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        # atomic rename, concurrent uploads of the same content end with the same file
+        os.replace(local_path, target_path)
+
+    async def delete(self, key: str):
+        path = self.path_of(key)
+        if await asyncio.to_thread(os.path.exists, path):
+            await asyncio.to_thread(os.remove, path)
+
+    def download_url(self, reference: str) -> str:
+        key = self.key_of(reference)
+        expires = stable_expire_time(self.signed_url_ttl)
+        return f"{self.download_prefix}/{key}?expires={expires}&signature={sign(key, expires)}"
+
+    @asynccontextmanager
+    async def local_copy(self, key: str):
+        yield self.path_of(key)
+
+
+class S3Storage(StorageBackend):
+    """
+    S3 兼容存储（AWS S3 / MinIO 等），大文件分片上传，下载使用预签名URL，文件不经过 Python worker
+    """
+
+    def __init__(self, bucket: str, endpoint_url: str | None = None, access_key: str | None = None,
+                 secret_key: str | None = None, region: str | None = None, url_prefix: str = "static",
+                 presign_expire_seconds: int = 3600, multipart_threshold: int = 8 * 1024 * 1024,
+                 multipart_chunk_size: int = 8 * 1024 * 1024, client=None):
+        super().__init__(url_prefix, tempfile.gettempdir())
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("boto3 package is required by S3Storage, please install boto3")
+            client = boto3.client("s3", endpoint_url=endpoint_url, aws_access_key_id=access_key,
+                                  aws_secret_access_key=secret_key, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.presign_expire_seconds = presign_expire_seconds
+        # files above the threshold are uploaded in parts, parts are sent concurrently by boto3
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_chunk_size)
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def save_file(self, local_path: str, key: str, content_type: str | None = None):
+        extra_args = {"ContentType": content_type} if content_type else None
+        try:
+            await asyncio.to_thread(self.client.upload_file, local_path, self.bucket, key,
+                                    ExtraArgs=extra_args, Config=self.transfer_config)
+        finally:
+            await asyncio.to_thread(os.remove, local_path)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    @asynccontextmanager
+    async def local_copy(self, key: str):
+        local_path = os.path.join(self.tmp_dir, uuid.uuid4().hex + os.path.splitext(key)[1])
+        await asyncio.to_thread(self.client.download_file, self.bucket, key, local_path)
+        try:
+            yield local_path
+        finally:
+            await asyncio.to_thread(os.remove, local_path)
+
+    def download_url(self, reference: str) -> str:
+        # presigning is a local signature computation, no network round trip
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.key_of(reference)},
+            ExpiresIn=self.presign_expire_seconds,
+        )
+
+
+def create_storage(conf: dict) -> StorageBackend:
+    backend = conf.get("backend", "local")
+    url_prefix = conf.get("url_prefix", "static")
+    if backend == "s3":
+        s3 = conf.get("s3", {})
+        return S3Storage(
+            bucket=s3.get("bucket"),
+            endpoint_url=s3.get("endpoint_url"),
+            access_key=s3.get("access_key"),
+            secret_key=s3.get("secret_key"),
+            region=s3.get("region"),
+            url_prefix=url_prefix,
+            presign_expire_seconds=s3.get("presign_expire_seconds", 3600),
+            multipart_threshold=s3.get("multipart_threshold_mb", 8) * 1024 * 1024,
+            multipart_chunk_size=s3.get("multipart_chunk_mb", 8) * 1024 * 1024,
+        )
+    if backend == "local":
+        return LocalStorage(conf.get("local_dir", project_conf().get("static_files_path", "attachments")), url_prefix,
+                            signed_url_ttl=conf.get("signed_url_ttl_seconds", 86400))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+storage = create_storage(storage_conf())
@@ -0,0 +1,51 @@
+import io
+
+THUMBNAIL_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".pdf"}
+THUMBNAIL_FORMAT = "JPEG"
+THUMBNAIL_EXT = ".thumb.jpg"
+
+
+def can_render_thumbnail(ext: str) -> bool:
+    return ext in THUMBNAIL_EXTENSIONS
+
+
+def thumbnail_key(key: str) -> str:
+    """缩略图与原文件放在同一目录，如 ab/cd/abcd...ef.pdf -> ab/cd/abcd...ef.thumb.jpg"""
+    return key.rsplit(".", 1)[0] + THUMBNAIL_EXT
+
+
+def render_thumbnail(source_path: str, ext: str, max_size: int) -> bytes | None:
+    """
+    render a jpeg thumbnail of an image or the first page of a pdf, cpu bound, runs in a worker process
+    returns None when the optional imaging libraries are not installed
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    if ext == ".pdf":
+        try:
+            import pypdfium2
+        except ImportError:
+            return None
+        pdf = pypdfium2.PdfDocument(source_path)
+        try:
+            page = pdf[0]
+            # render just large enough for the thumbnail instead of the full page resolution
+            scale = max_size / max(page.get_width(), page.get_height())
+            image = page.render(scale=max(scale, 0.1)).to_pil()
+        finally:
+            pdf.close()
+    else:
+        image = Image.open(source_path)
+        # decode at a reduced size when the format supports it (jpeg draft mode)
+        image.draft("RGB", (max_size, max_size))
+
+    image.thumbnail((max_size, max_size))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, THUMBNAIL_FORMAT, quality=80, optimize=True)
+    return output.getvalue()
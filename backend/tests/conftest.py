@@ -0,0 +1,67 @@
+"""
+测试用 sqlite 代替 PostgreSQL，每个测试一个新数据库
+"""
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from src.controller.file_controller import file_router
+from src.controller.ticket_controller import ticket_router
+from src.controller.user_controller import user_router
+from src.db import db_configs
+from src.db.db_metrics import InstrumentedAsyncQueuePool
+from src.db.modals.base_db import Base
+from src.router.router_config import add_metrics_middleware
+from src.service import file_service
+from src.utils.metrics import REQUEST_DB_CHECKOUTS
+from src.utils.response import FastJSONResponse
+from src.utils.storage import LocalStorage
+
+
+@compiles(REGCONFIG, "sqlite")
+def _regconfig_on_sqlite(type_, compiler, **kw):
+    return "TEXT"
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    return tmp_path / "test.db"
+
+
+@pytest.fixture
+def engine(database_path, tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}", poolclass=InstrumentedAsyncQueuePool)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _register_functions(connection, _):
+        # stands in for postgres to_tsvector in the search document index
+        connection.create_function("to_tsvector", 2, lambda config, text: text.lower(), deterministic=True)
+
+    monkeypatch.setattr(db_configs, "async_engine", engine)
+    monkeypatch.setattr(db_configs, "read_only_engine", engine)
+    monkeypatch.setitem(db_configs.AsyncSessionLocal.kw, "bind", engine)
+    monkeypatch.setattr(file_service, "storage", LocalStorage(str(tmp_path / "attachments")))
+
+    async def create_tables():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_tables())
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def app(engine):
+    app = FastAPI(default_response_class=FastJSONResponse)
+    add_metrics_middleware(app)
+    app.include_router(user_router)
+    app.include_router(ticket_router)
+    app.include_router(file_router)
+    REQUEST_DB_CHECKOUTS._values.clear()
+    return app
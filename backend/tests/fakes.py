@@ -0,0 +1,37 @@
+"""
+本地替身，测试不依赖外部服务
+"""
+import time
+
+
+class FakeRedis:
+    """
+    in memory stand-in for the redis.asyncio client, only the commands the session store uses,
+    values come back as bytes like from a real server
+    """
+
+    def __init__(self):
+        self._values: dict[str, tuple[bytes, float | None]] = {}
+
+    def _get(self, key: str) -> bytes | None:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expire_at = item
+        if expire_at is not None and expire_at <= time.time():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value, ex: int | None = None):
+        self._values[key] = (str(value).encode(), time.time() + ex if ex is not None else None)
+        return True
+
+    async def get(self, key: str) -> bytes | None:
+        return self._get(key)
+
+    async def mget(self, *keys: str) -> list[bytes | None]:
+        return [self._get(key) for key in keys]
+
+    async def exists(self, *keys: str) -> int:
+        return sum(self._get(key) is not None for key in keys)
@@ -0,0 +1,64 @@
+"""
+TTLCache.get_or_load：并发未命中只加载一次，加载任务被取消时其他等待者自己重新加载
+"""
+import asyncio
+
+import pytest
+
+from src.utils.cache import TTLCache
+
+
+def test_concurrent_misses_load_once():
+    cache = TTLCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return "value"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_cancelled_loader_does_not_cancel_waiters():
+    cache = TTLCache()
+    started = []
+
+    async def loader():
+        started.append(1)
+        if len(started) == 1:
+            # the first load hangs until its task is cancelled
+            await asyncio.Event().wait()
+        return "value"
+
+    async def run():
+        first = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await waiter
+
+    assert asyncio.run(run()) == "value"
+    assert len(started) == 2
+    assert cache.get("key") == "value"
+
+
+def test_loader_error_reaches_waiters():
+    cache = TTLCache()
+
+    async def loader():
+        await asyncio.sleep(0)
+        raise RuntimeError("load failed")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
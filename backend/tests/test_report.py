@@ -0,0 +1,39 @@
+"""
+金额报表：amount / purchaser_id 为 NULL 的旧数据不参与统计
+"""
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import insert
+
+from src.db import db_configs
+from src.db.db_enum import TicketStatus, UserGroup
+from src.db.modals.ticket import Ticket
+from src.db.modals.user import User
+from src.service.report_service import load_amounts
+
+
+def test_rows_with_null_are_skipped(engine):
+    now = datetime.now()
+    ticket = {"currency": "CNY", "status": TicketStatus.PENDING, "purchase_time": now, "created_time": now,
+              "updated_time": now, "deleted": 0}
+
+    async def run():
+        async with engine.begin() as connection:
+            await connection.execute(insert(User), [{
+                "username": "employer", "email": "employer@example.com", "password": "x", "group": UserGroup.EMPLOYER,
+                "created_time": now, "updated_time": now, "deleted": 0,
+            }])
+            await connection.execute(insert(Ticket), [
+                {**ticket, "purchaser_id": 1, "amount": Decimal("12.50")},
+                {**ticket, "purchaser_id": 1, "amount": None},
+                {**ticket, "purchaser_id": None, "amount": Decimal("3.00")},
+            ])
+        async with db_configs.AsyncSessionLocal() as db:
+            employer = await db.get(User, 1)
+            return await load_amounts(db, employer)
+
+    purchaser_ids, amounts = asyncio.run(run())
+    assert list(purchaser_ids) == [1]
+    assert list(amounts) == [1250]
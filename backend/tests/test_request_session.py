@@ -0,0 +1,117 @@
+"""
+请求级会话在发送响应之前提交，提交失败时返回 500，流式导出期间只占用一个连接
+写入主库的用户在发送响应之前记录到所有 worker 共享的 session store
+"""
+import asyncio
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+
+import httpx
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db import db_configs
+from src.db.db_enum import TicketStatus
+from src.db.db_replicas import RecentWriters, ReplicaSet
+from src.db.modals.ticket import Ticket
+from src.utils.session_store import MemorySessionStore
+
+PASSWORD = "Passw0rd!"
+REGISTER = {"email": "employer@example.com", "password": PASSWORD, "username": "employer", "group": "EMPLOYER"}
+
+
+def count_users(database_path) -> int:
+    # a connection outside the pool only sees committed rows
+    with sqlite3.connect(database_path) as connection:
+        return connection.execute("SELECT count(*) FROM user").fetchone()[0]
+
+
+async def post_register(app, raise_app_exceptions=True, on_response_start=None) -> httpx.Response:
+    async def asgi(scope, receive, send):
+        async def observed_send(message):
+            if message["type"] == "http.response.start" and on_response_start:
+                await on_response_start()
+            await send(message)
+
+        await app(scope, receive, observed_send)
+
+    transport = httpx.ASGITransport(app=asgi, raise_app_exceptions=raise_app_exceptions)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/api/register", json=REGISTER)
+
+
+def test_commit_before_response(app, database_path):
+    users_at_response_start = []
+
+    async def on_response_start():
+        users_at_response_start.append(count_users(database_path))
+
+    response = asyncio.run(post_register(app, on_response_start=on_response_start))
+
+    assert response.status_code == 200, response.text
+    assert users_at_response_start == [1]
+
+
+def test_failed_commit_returns_500(app, database_path, monkeypatch):
+    async def failing_commit(self):
+        raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(AsyncSession, "commit", failing_commit)
+    response = asyncio.run(post_register(app, raise_app_exceptions=False))
+
+    assert response.status_code == 500
+    assert count_users(database_path) == 0
+
+
+def test_writer_marked_for_all_workers_before_response(app, engine, monkeypatch):
+    store = MemorySessionStore()
+    monkeypatch.setattr(db_configs, "recent_writers", RecentWriters(store, 10))
+    # writers are only marked when replicas are configured, register never reads from it
+    monkeypatch.setattr(db_configs, "replica_set", ReplicaSet({"replica0": engine}))
+    # another worker only shares the session store
+    other_worker = RecentWriters(store, 10)
+    marked_at_response_start = []
+
+    async def on_response_start():
+        marked_at_response_start.append(await other_worker.contains(1))
+
+    response = asyncio.run(post_register(app, on_response_start=on_response_start))
+
+    assert response.status_code == 200, response.text
+    assert marked_at_response_start == [True]
+
+
+async def export_tickets(app, engine, connections_while_streaming: list) -> httpx.Response:
+    async def asgi(scope, receive, send):
+        async def observed_send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                connections_while_streaming.append(engine.sync_engine.pool.checkedout())
+            await send(message)
+
+        await app(scope, receive, observed_send)
+
+    transport = httpx.ASGITransport(app=asgi)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/api/register", json=REGISTER)
+        response = await client.post("/api/login", json={"email": REGISTER["email"], "password": PASSWORD})
+        headers = {"Authorization": f"Bearer {response.json()['data']['token']}"}
+
+        now = datetime.now()
+        async with engine.begin() as connection:
+            await connection.execute(insert(Ticket), [{
+                "purchaser_id": 1, "amount": Decimal("12.50"), "currency": "CNY", "merchant": f"商户 {i}",
+                "status": TicketStatus.PENDING, "purchase_time": now, "created_time": now, "updated_time": now,
+                "deleted": 0,
+            } for i in range(3)])
+        return await client.get("/api/tickets/export", headers=headers)
+
+
+def test_export_holds_one_connection(app, engine):
+    connections_while_streaming = []
+    response = asyncio.run(export_tickets(app, engine, connections_while_streaming))
+
+    assert response.status_code == 200, response.text
+    assert len(response.text.splitlines()) == 3
+    # the request's session released its connection before the body, only the export's read session is open
+    assert max(connections_while_streaming) == 1
@@ -0,0 +1,28 @@
+"""
+FastJSONResponse：安装和未安装 orjson 时输出相同的 JSON
+"""
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+from src.db.db_enum import TicketStatus
+from src.utils import response
+
+
+def test_fallback_matches_orjson(monkeypatch):
+    pytest.importorskip("orjson")
+    content = {
+        "status": TicketStatus.APPROVED,
+        "amount": Decimal("12.50"),
+        "created_time": datetime.datetime(2025, 3, 1, 9, 30, 15, 123456),
+        "day": datetime.date(2025, 3, 1),
+        "items": [{"name": "报销", "count": 2}],
+        1: None,
+    }
+    fast = response.dumps(content)
+    monkeypatch.setattr(response, "orjson", None)
+
+    assert json.loads(response.dumps(content)) == json.loads(fast)
+    assert json.loads(fast)["status"] == "approved"
@@ -0,0 +1,53 @@
+"""
+每个请求只从连接池取一次连接：接口、依赖和 service 共用请求级会话
+用 sqlite 代替 PostgreSQL，按 InstrumentedAsyncQueuePool 记录的 checkouts 断言
+"""
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from src.utils.metrics import REQUEST_DB_CHECKOUTS
+
+PASSWORD = "Passw0rd!"
+
+
+def checkouts(method: str, route: str) -> tuple[int, float]:
+    """(requests, checkouts) recorded for the route"""
+    counts, total = REQUEST_DB_CHECKOUTS._values[(method, route)]
+    return sum(counts), total
+
+
+async def call_app(app: FastAPI):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for email, group in (("employer@example.com", "EMPLOYER"), ("employee@example.com", "EMPLOYEE")):
+            response = await client.post("/api/register", json={
+                "email": email, "password": PASSWORD, "username": group.lower(), "group": group
+            })
+            assert response.status_code == 200, response.text
+
+        response = await client.post("/api/login", json={"email": "employer@example.com", "password": PASSWORD})
+        assert response.status_code == 200, response.text
+        headers = {"Authorization": f"Bearer {response.json()['data']['token']}"}
+
+        response = await client.get("/api/user/list", headers=headers)
+        assert response.status_code == 200, response.text
+
+        files = [("files", (f"receipt{i}.png", f"content {i % 2}".encode(), "image/png")) for i in range(6)]
+        response = await client.post("/api/files/tickets/attachment", files=files, headers=headers)
+        assert response.status_code == 200, response.text
+        assert response.json()["data"]["file_count"] == 6
+        # identical contents of one upload share one attachment
+        assert len(set(response.json()["data"]["urls"].split(","))) == 2
+
+
+def test_one_checkout_per_request(app):
+    asyncio.run(call_app(app))
+
+    assert checkouts("POST", "/api/register") == (2, 2)
+    assert checkouts("POST", "/api/login") == (1, 1)
+    # the user lookup of get_current_user and the listing share the session
+    assert checkouts("GET", "/api/user/list") == (1, 1)
+    # six files, the dedupe lookup and the insert of the new attachments run in one session
+    assert checkouts("POST", "/api/files/tickets/attachment") == (1, 1)
@@ -0,0 +1,104 @@
+"""
+token 撤销：进程内实现和 Redis 实现（FakeRedis）行为一致，退出登录和暂停用户后旧 token 返回 401
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from src.router import dependencies
+from src.service import user_service
+from src.utils.session_store import MemorySessionStore, RedisSessionStore
+from tests.fakes import FakeRedis
+
+PASSWORD = "Passw0rd!"
+EMPLOYER = {"email": "employer@example.com", "password": PASSWORD}
+EMPLOYEE = {"email": "employee@example.com", "password": PASSWORD}
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, monkeypatch):
+    store = MemorySessionStore() if request.param == "memory" else RedisSessionStore(client=FakeRedis())
+    monkeypatch.setattr(dependencies, "session_store", store)
+    monkeypatch.setattr(user_service, "session_store", store)
+    return store
+
+
+def test_revoke_token(store):
+    async def check():
+        await store.revoke_token("revoked", 60)
+        return await store.is_valid("revoked", 1, 100), await store.is_valid("other", 1, 100)
+
+    assert asyncio.run(check()) == (False, True)
+
+
+def test_revoke_user_cuts_off_earlier_tokens(store, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+
+    async def check():
+        await store.revoke_user(1, 60)
+        return [await store.is_valid("a", 1, int(now) - 10), await store.is_valid("b", 1, None),
+                await store.is_valid("c", 1, int(now) + 1), await store.is_valid("d", 2, int(now) - 10)]
+
+    assert asyncio.run(check()) == [False, False, True, True]
+
+
+def test_revocation_expires(store, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+
+    async def revoke():
+        await store.revoke_token("revoked", 60)
+        await store.revoke_user(1, 60)
+
+    asyncio.run(revoke())
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert asyncio.run(store.is_valid("revoked", 1, int(now) - 10))
+
+
+async def login(client: httpx.AsyncClient, account: dict) -> dict:
+    response = await client.post("/api/login", json=account)
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['data']['token']}"}
+
+
+async def register(client: httpx.AsyncClient, account: dict, group: str):
+    response = await client.post("/api/register", json={**account, "username": group.lower(), "group": group})
+    assert response.status_code == 200, response.text
+
+
+def test_logout_revokes_token(app, store):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await register(client, EMPLOYEE, "EMPLOYEE")
+            headers = await login(client, EMPLOYEE)
+            before = await client.get("/api/tickets/", headers=headers)
+            logout = await client.post("/api/logout", headers=headers)
+            after = await client.get("/api/tickets/", headers=headers)
+            return before.status_code, logout.status_code, after.status_code
+
+    assert asyncio.run(run()) == (200, 200, 401)
+
+
+def test_suspend_revokes_tokens(app, store):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await register(client, EMPLOYER, "EMPLOYER")
+            await register(client, EMPLOYEE, "EMPLOYEE")
+            employer = await login(client, EMPLOYER)
+            employee = await login(client, EMPLOYEE)
+            before = await client.get("/api/tickets/", headers=employee)
+
+            for suspended in (True, False):
+                response = await client.put("/api/user/suspend", headers=employer,
+                                            json={"user_id": 2, "suspended": suspended})
+                assert response.status_code == 200, response.text
+            # the user is active again, the token issued before the suspension stays revoked
+            after = await client.get("/api/tickets/", headers=employee)
+            return before.status_code, after.status_code
+
+    assert asyncio.run(run()) == (200, 401)
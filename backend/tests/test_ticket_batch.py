@@ -0,0 +1,40 @@
+"""
+批量创建 ticket：带时区和不带时区的 purchase_time 混在同一批里
+"""
+import asyncio
+import sqlite3
+from datetime import datetime, timezone
+
+import httpx
+
+PASSWORD = "Passw0rd!"
+
+
+async def create_batch(app, tickets: list[dict]) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        account = {"email": "employee@example.com", "password": PASSWORD}
+        await client.post("/api/register", json={**account, "username": "employee", "group": "EMPLOYEE"})
+        response = await client.post("/api/login", json=account)
+        headers = {"Authorization": f"Bearer {response.json()['data']['token']}"}
+        return await client.post("/api/tickets/batch", json={"tickets": tickets}, headers=headers)
+
+
+def test_mixed_offsets_in_one_batch(app, database_path):
+    aware = datetime(2025, 3, 10, 12, 0, tzinfo=timezone.utc)
+    tickets = [
+        {"amount": "10.00", "purchase_time": aware.isoformat()},
+        {"amount": "20.00", "purchase_time": "2025-03-11 09:30"},
+        {"amount": "30.00", "purchase_time": "2025-03-12T09:30:00+08:00"},
+    ]
+    response = asyncio.run(create_batch(app, tickets))
+
+    assert response.status_code == 200, response.text
+    assert response.json()["data"]["created_count"] == 3
+    with sqlite3.connect(database_path) as connection:
+        purchase_times = [row[0] for row in connection.execute("SELECT purchase_time FROM ticket ORDER BY id")]
+        summaries = connection.execute("SELECT month, ticket_count FROM ticket_summary").fetchall()
+    # stored as naive local time, like the rest of the DateTime columns
+    assert purchase_times[0].startswith(aware.astimezone().strftime("%Y-%m-%d %H:%M:%S"))
+    assert all("+" not in value for value in purchase_times)
+    assert summaries == [("2025-03-01 00:00:00.000000", 3)]
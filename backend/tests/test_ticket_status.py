@@ -0,0 +1,34 @@
+"""
+单个 ticket 审批：ticket 不存在返回 404，未知状态返回 400
+"""
+import asyncio
+
+import httpx
+
+from src.common.business_error_code import ErrorCode
+
+PASSWORD = "Passw0rd!"
+EMPLOYER = {"email": "employer@example.com", "password": PASSWORD}
+
+
+async def put_status(app, ticket_id: int, status: str) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/api/register", json={**EMPLOYER, "username": "employer", "group": "EMPLOYER"})
+        response = await client.post("/api/login", json=EMPLOYER)
+        headers = {"Authorization": f"Bearer {response.json()['data']['token']}"}
+        return await client.put(f"/api/tickets/{ticket_id}/status", json={"status": status}, headers=headers)
+
+
+def test_missing_ticket_returns_404(app):
+    response = asyncio.run(put_status(app, 999, "APPROVED"))
+
+    assert response.status_code == 404
+    assert response.json()["detail"]["error_code"] == ErrorCode.ticket_not_found
+
+
+def test_unknown_status_returns_400(app):
+    response = asyncio.run(put_status(app, 999, "DONE"))
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["error_code"] == ErrorCode.invalid_parameter
@@ -17,6 +17,10 @@ const AttachmentPreview: React.FC<AttachmentPreviewProps> = ({
     // 移除可能的前导逗号或空格
     const getCleanUrl = (url: string): string => {
         const cleanUrl = url.replace(/^[, ]+/, '');
+        // 对象存储返回的是完整的预签名URL，不需要拼接前缀
+        if (/^https?:\/\//.test(cleanUrl)) {
+            return cleanUrl;
+        }
         return `${urlPrefix}${cleanUrl}`;
     };
 
@@ -10,6 +10,7 @@ interface EmployeeListResponse<T> {
     success: boolean;
     data?: T;
     message?: string;
+    next_cursor?: string | null;
 }
 
 const EmployeeList: React.FC = () => {
@@ -18,18 +19,23 @@ const EmployeeList: React.FC = () => {
     const [isLoading, setIsLoading] = useState(true);
     const [error, setError] = useState<string>('');
     const [processingId, setProcessingId] = useState<string | null>(null);
+    // 下一页的游标，为 null 时已经是最后一页
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
 
     // 组件加载时获取用户列表
     useEffect(() => {
         fetchUsers();
     }, []);
 
-    // 获取用户列表
-    const fetchUsers = async () => {
-        setIsLoading(true);
+    // 获取用户列表，传入游标时加载下一页并追加到列表末尾
+    const fetchUsers = async (cursor?: string) => {
+        const setLoading = cursor ? setIsLoadingMore : setIsLoading;
+        setLoading(true);
         setError('');
         try {
-            const response = await fetch(`${url_prefix}/user/list`, {
+            const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+            const response = await fetch(`${url_prefix}/user/list${query}`, {
                 method: 'GET',
                 headers: {
                     'Authorization': `Bearer ${cookies.Authorization}`,
@@ -44,7 +50,9 @@ const EmployeeList: React.FC = () => {
             const result: EmployeeListResponse<User[]> = await response.json();
 
             if (result.success && result.data) {
-                setUsers(result.data);
+                const page = result.data;
+                setUsers(prevUsers => cursor ? [...prevUsers, ...page] : page);
+                setNextCursor(result.next_cursor ?? null);
             } else {
                 throw new Error(result.message || '获取用户列表失败');
             }
@@ -52,7 +60,7 @@ const EmployeeList: React.FC = () => {
             console.error('获取用户列表失败:', error);
             setError(error instanceof Error ? error.message : '网络错误，请检查连接');
         } finally {
-            setIsLoading(false);
+            setLoading(false);
         }
     };
 
@@ -182,6 +190,14 @@ const EmployeeList: React.FC = () => {
                     keyExtractor={(item) => item.id}
                 />
             )}
+
+            {!isLoading && nextCursor && (
+                <div className="flex justify-center mt-4">
+                    <Button onClick={() => fetchUsers(nextCursor)} disabled={isLoadingMore}>
+                        {isLoadingMore ? '加载中...' : '加载更多'}
+                    </Button>
+                </div>
+            )}
         </div>
     );
 };
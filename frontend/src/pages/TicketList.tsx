@@ -12,6 +12,12 @@ import {file_prefix, url_prefix} from "../common/const.tsx";
 interface TicketListResponse {
     success: boolean;
     data?: [];
+    next_cursor?: string | null;
+}
+
+interface TicketPage {
+    tickets: Ticket[];
+    nextCursor: string | null;
 }
 
 const TicketList: React.FC = () => {
@@ -27,6 +33,9 @@ const TicketList: React.FC = () => {
     const [selectedFiles, setSelectedFiles] = useState<File[]>([]); // 改为文件数组
 
     const [tickets, setTickets] = useState<Ticket[]>([]);
+    // 下一页的游标，为 null 时已经是最后一页
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
 
     useEffect(() => {
         initTickets();
@@ -35,15 +44,32 @@ const TicketList: React.FC = () => {
     // 初始化ticket列表
     const initTickets = async () => {
         try {
-            const data = await fetchTickets(cookies.Authorization);
-            setTickets(data);
+            const page = await fetchTickets(cookies.Authorization);
+            setTickets(page.tickets);
+            setNextCursor(page.nextCursor);
         } catch (error) {
             console.error('获取ticket数据失败:', error);
         }
     };
 
-    const fetchTickets = async (token: string): Promise<Ticket[]> => {
-        const response = await fetch(`${url_prefix}/tickets`, {
+    // 加载下一页，追加到列表末尾
+    const loadMoreTickets = async () => {
+        if (!nextCursor) return;
+        setIsLoadingMore(true);
+        try {
+            const page = await fetchTickets(cookies.Authorization, nextCursor);
+            setTickets(prevTickets => [...prevTickets, ...page.tickets]);
+            setNextCursor(page.nextCursor);
+        } catch (error) {
+            console.error('获取ticket数据失败:', error);
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
+
+    const fetchTickets = async (token: string, cursor?: string): Promise<TicketPage> => {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const response = await fetch(`${url_prefix}/tickets${query}`, {
             method: 'GET',
             headers: {
                 'Authorization': `Bearer ${token}`,
@@ -58,7 +84,7 @@ const TicketList: React.FC = () => {
     const result: TicketListResponse = await response.json();
 
     if (result.success && result.data) {
-        return result.data;
+        return {tickets: result.data, nextCursor: result.next_cursor ?? null};
     } else {
         throw new Error('获取数据失败');
     }
@@ -120,7 +146,7 @@ const TicketList: React.FC = () => {
                 throw new Error('审批操作失败');
             }
 
-            await fetchTickets(cookies.Authorization).then(data => setTickets(data));
+            await initTickets();
 
             // 刷新数据或更新本地状态
             alert(`工单 ${ticketId} 已${newStatus === 'APPROVED' ? '批准' : '拒绝'}`);
@@ -279,6 +305,14 @@ const TicketList: React.FC = () => {
                 keyExtractor={(item) => item.id}
             />
 
+            {nextCursor && (
+                <div className="flex justify-center mt-4">
+                    <Button onClick={loadMoreTickets} disabled={isLoadingMore}>
+                        {isLoadingMore ? '加载中...' : '加载更多'}
+                    </Button>
+                </div>
+            )}
+
             {/* 新建工单Modal */}
             <Modal
                 isOpen={isModalOpen}